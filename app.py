@@ -1,124 +1,285 @@
 import json
-import asyncio
-from threading import Thread
 import functools
+import time
 import peewee
 import settings
 from podcastd.log import Logger
-from flask import Flask, request
-from podcastd import Podcast, Episode, BaseModel, DateTimeEncoder
-from podcastd.utils import slack
+from flask import Blueprint, Flask, Response, current_app, g, request
+from podcastd import Podcast, Episode, BaseModel, DateTimeEncoder, Scheduler
+from podcastd import events, metrics
+from podcastd.api import filter_status, next_link, parse_limit, respond
+from podcastd.base_model import db
+from podcastd.migrations import migrate_database
+from podcastd.search import DEFAULT_LIMIT as SEARCH_LIMIT, parse_cursor, search as search_episodes
+from podcastd.serialize import serialize_one
+from podcastd.subscriptions import check_intervals, import_podcasts, parse_import
+from podcastd.sync import SyncError, resolve_target
 from playhouse.shortcuts import model_to_dict
 
+# The routes are only bound to an app, and the loggers and scheduler only
+# started, by create_app. Processes that import this module, the tag
+# workers included, start neither.
+# pylint: disable=C0103
+routes = Blueprint('podcastd', __name__)
+scheduler = None
 
-def worker(loop):
-    """ Create an event loop
+def create_app():
+    """ Build the app, set up its logging and metrics and start the scheduler
+
+        Returns:
+            Flask: The app
+    """
+    global scheduler # pylint: disable=W0603
+    app = Logger(settings=settings).add_loggers(flask_app=Flask(__name__))
+    app.register_blueprint(routes)
+    metrics.enable(getattr(settings, 'METRICS_ENABLED', False))
+    scheduler = Scheduler(settings=settings)
+    return app
+
+@routes.before_app_request
+def metrics_start():
+    """ Note when the request started
     """
-    asyncio.set_event_loop(loop)
-    loop.run_forever()
+    if metrics.enabled:
+        g.request_start = time.perf_counter()
 
-app = Flask(__name__)
+@routes.after_app_request
+def metrics_observe(response):
+    """ Record the request's latency against its route
+    """
+    if metrics.enabled and 'request_start' in g:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, method=request.method,
+                                        route=route, status=response.status_code)
+    return response
+
+@routes.before_app_request
+def db_connect():
+    """ Open a connection for the request's thread
+    """
+    db.connect(reuse_if_open=True)
 
-cls_logger = Logger(settings=settings)
-app = cls_logger.add_loggers(flask_app=app)
-worker_loop = asyncio.new_event_loop()
-worker = Thread(target=worker, args=(worker_loop,))
-worker.start()
+def db_close():
+    """ Close the current thread's connection
+    """
+    if not db.is_closed():
+        db.close()
 
-def update_episodes():
-    added = 0
-    downloaded = 0
-    removed = 0
-    for podcast in Podcast.select():
-        added += podcast.download_feed()
-        removed += podcast.remove_expired_episodes()
-        downloaded += podcast.download_new(base_dir=settings.BASE_DIR)
-    app.logger.info("Added: %s, Downloaded: %s, Removed: %s" % (added, downloaded, removed))
-    if settings.SLACK_URL:
-        slack(added=added, removed=removed, downloaded=downloaded, webhook_url=settings.SLACK_URL)
+@routes.after_app_request
+def db_close_after_response(response):
+    """ Close the request's connection once the response is sent,
+        streamed responses read from the database until then
+    """
+    response.call_on_close(db_close)
+    return response
 
 def log(func):
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        app.logger.debug("%s %s" % (request.method, request.url))
+        current_app.logger.debug("%s %s" % (request.method, request.url))
         return func(*args, **kwargs)
     return wrapper
 
-@app.route('/episode/<int:episode_id>', methods=['GET'])
+@routes.route('/episode/<int:episode_id>', methods=['GET'])
 @log
 def episode(episode_id):
     """ Retrieve an episode by id
     """
-    response = [model_to_dict(x)
-                for x in Episode.select().where(Episode.id == episode_id)]
-    if len(response) == 1:
-        return json.dumps(response[0], cls=DateTimeEncoder)
+    response = serialize_one(Episode, Episode.select().where(Episode.id == episode_id))
+    if response:
+        return json.dumps(response)
     return json.dumps({"error": "Not found"}), 400
 
-@app.route('/episodes/<int:podcast_id>', methods=['GET'])
+@routes.route('/episodes/<int:podcast_id>', methods=['GET'])
 @log
 def episodes(podcast_id):
     """ Retrieve all episode for a podcast by id
     """
-    podc = Podcast.get(Podcast.id == podcast_id)
-    response = [model_to_dict(x)
-                for x in Episode.select().where(Episode.podcast == podc)]
-    return json.dumps(response, cls=DateTimeEncoder)
+    podc = Podcast.get_or_none(Podcast.id == podcast_id)
+    if not podc:
+        return json.dumps({"error": "Not found"}), 400
+    return respond(request, 'episodes', Episode, Episode.select().where(Episode.podcast == podc))
 
-@app.route('/podcast/<int:podcast_id>', methods=['GET', 'PUT'])
+@routes.route('/podcast/<int:podcast_id>', methods=['GET', 'PUT'])
 @log
 def podcast_get(podcast_id):
     """ Retreive a podcast by id
     """
     if request.method == 'GET':
-        response = [model_to_dict(x)
-                    for x in Podcast.select().where(Podcast.id == podcast_id)]
-        if len(response) == 1:
-            return json.dumps(response[0], cls=DateTimeEncoder)
+        response = serialize_one(Podcast, Podcast.select().where(Podcast.id == podcast_id))
+        if response:
+            return json.dumps(response)
         return json.dumps({"error": "Not found"}), 400
     elif request.method == 'PUT':
         podcast = Podcast.get_or_none(Podcast.id == podcast_id)
         if podcast:
-            for key, value in request.get_json().items():
+            details = request.get_json()
+            try:
+                check_intervals(details)
+            except ValueError as err:
+                return json.dumps({"error": str(err)}), 400
+            for key, value in details.items():
                 setattr(podcast, key, value)
             podcast.save()
             return json.dumps(model_to_dict(podcast), cls=DateTimeEncoder)
         return json.dumps({"error": "Not found"}), 400
 
-@app.route('/podcast', methods=['POST'])
+@routes.route('/podcast', methods=['POST'])
 @log
 def podcast_post():
     """ Create a new podcast subscription
     """
     details = request.get_json()
+    try:
+        check_intervals(details)
+    except ValueError as err:
+        return json.dumps({"error": str(err)}), 400
     podcast = Podcast(**details)
     try:
         podcast.save()
         podcast.build_directory(base_dir=settings.BASE_DIR)
-        response = [model_to_dict(x)
-                    for x in Podcast.select().where(Podcast.name == details['name'])]
-        return json.dumps(response[0], cls=DateTimeEncoder)
+        return json.dumps(serialize_one(Podcast, Podcast.select().where(Podcast.name == details['name'])))
     except peewee.IntegrityError as err:
-        app.logger.debug(err)
+        current_app.logger.debug(err)
+        return json.dumps({"error": str(err)}), 400
+
+@routes.route('/podcasts/import', methods=['POST'])
+@log
+def podcasts_import():
+    """ Create podcast subscriptions in bulk from OPML, JSON or YAML
+    """
+    defaults = {x: request.args[x] for x in ('max_age', 'max_episodes', 'refresh_interval') if x in request.args}
+    try:
+        items = parse_import(request.get_data(), request.content_type)
+        results = import_podcasts(items, base_dir=settings.BASE_DIR, defaults=defaults)
+    except ValueError as err:
         return json.dumps({"error": str(err)}), 400
+    added = [x['id'] for x in results if x['status'] == 'added']
+    job = None
+    if added and request.args.get('fetch', '').lower() in ('1', 'true', 'yes'):
+        job = scheduler.submit(podcast_ids=added).id
+    response = {'added': len(added),
+                'duplicate': len([x for x in results if x['status'] == 'duplicate']),
+                'invalid': len([x for x in results if x['status'] == 'invalid']),
+                'job': job,
+                'podcasts': results}
+    return json.dumps(response)
 
-@app.route('/podcasts', methods=['GET'])
+@routes.route('/podcasts', methods=['GET'])
 @log
 def podcasts():
     """ Retreive all podcasts
     """
-    response = [model_to_dict(x) for x in Podcast.select()]
-    return json.dumps(response, cls=DateTimeEncoder)
+    return respond(request, 'podcasts', Podcast, Podcast.select())
+
+@routes.route('/search', methods=['GET'])
+@log
+def search():
+    """ Search the episodes' titles, authors and descriptions and the podcasts' names
+    """
+    try:
+        query = filter_status(Episode, Episode.select(), request.args.get('status'))
+        rows, cursor = search_episodes(request.args.get('q', ''), query=query,
+                                       limit=parse_limit(request.args.get('limit')) or SEARCH_LIMIT,
+                                       after=parse_cursor(request.args.get('after')))
+    except ValueError as err:
+        return json.dumps({"error": str(err)}), 400
+    response = Response(json.dumps(rows), mimetype='application/json')
+    if cursor is not None:
+        response.headers['Link'] = next_link(request, cursor)
+    return response
+
+@routes.route('/events', methods=['GET'])
+@log
+def events_get():
+    """ Stream the episodes added, downloaded, tagged and removed and the finished jobs
+    """
+    last_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id'))
+    try:
+        last_id = int(last_id) if last_id else None
+    except ValueError:
+        return json.dumps({"error": "Invalid event id: %s" % last_id}), 400
+    kinds = request.args.get('types')
+    subscriber = events.bus.subscribe(last_id=last_id,
+                                      kinds=set(kinds.split(',')) if kinds else None)
+    # The stream can stay open for hours, it must not hold a connection
+    db_close()
+
+    def stream():
+        try:
+            yield "retry: 5000\n\n"
+            while not subscriber.closed or subscriber.events:
+                event = subscriber.get(timeout=events.KEEPALIVE)
+                yield events.to_sse(event) if event else ": keepalive\n\n"
+        finally:
+            events.bus.unsubscribe(subscriber)
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
-@app.route('/update', methods=['POST'])
+@routes.route('/update', methods=['POST'])
 @log
 def update():
     """ Trigger an update
     """
-    worker_loop.call_soon_threadsafe(update_episodes)
-    return json.dumps({"status": "ok"})
+    job = scheduler.submit()
+    return json.dumps({"status": "ok", "job": job.id})
 
-if __name__ == '__main__':
-    BaseModel().database.create_tables([Podcast, Episode])
+@routes.route('/update/<int:podcast_id>', methods=['POST'])
+@log
+def update_podcast(podcast_id):
+    """ Trigger an update of a single podcast
+    """
+    if not Podcast.get_or_none(Podcast.id == podcast_id):
+        return json.dumps({"error": "Not found"}), 400
+    job = scheduler.submit(podcast_ids=[podcast_id])
+    return json.dumps({"status": "ok", "job": job.id})
+
+@routes.route('/sync', methods=['POST'])
+@log
+def sync():
+    """ Trigger a sync of the downloaded episodes to a player
+    """
+    target = request.args.get('target')
+    try:
+        resolve_target(settings, target, allow_paths=False)
+    except SyncError as err:
+        return json.dumps({"error": str(err)}), 400
+    target = target or next(iter(settings.SYNC_TARGETS))
+    job = scheduler.submit(kind='sync', target=target)
+    return json.dumps({"status": "ok", "job": job.id})
+
+@routes.route('/compact', methods=['POST'])
+@log
+def compact():
+    """ Trigger the archival of old episodes and a vacuum of the database
+    """
+    job = scheduler.submit(kind='compact')
+    return json.dumps({"status": "ok", "job": job.id})
+
+@routes.route('/jobs', methods=['GET'])
+@log
+def jobs():
+    """ Retrieve the recent, running and queued update jobs
+    """
+    return json.dumps(scheduler.jobs())
+
+@routes.route('/metrics', methods=['GET'])
+def metrics_get():
+    """ Retrieve the metrics in the Prometheus text format
+    """
+    if not metrics.enabled:
+        return json.dumps({"error": "Metrics are disabled"}), 400
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+def main():
+    """ Serve the API
+    """
+    migrate_database(BaseModel().database)
+    app = create_app()
     app.logger.info("Starting.")
-    app.run(debug=settings.FLASK_DEBUG, host='0.0.0.0', threaded=False)
+    app.run(debug=settings.FLASK_DEBUG, host='0.0.0.0',
+            threaded=getattr(settings, 'FLASK_THREADED', True))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+""" Measure API GET latency while an update writes to the database
+
+    python benchmarks/api_load.py
+    python benchmarks/api_load.py --legacy
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import peewee
+import requests
+from werkzeug.serving import make_server
+
+from common import load_settings, percentile
+
+def seed(podcasts, episodes):
+    """ Fill the database with podcasts and episodes
+
+        Args:
+            podcasts (int): The number of podcasts
+            episodes (int): The number of episodes per podcast
+
+    """
+    from podcastd import Podcast, Episode
+    from podcastd.base_model import db
+    with db.atomic():
+        for pidx in range(podcasts):
+            podcast = Podcast.create(name="Podcast %s" % pidx, max_age='7d', max_episodes=3,
+                                     url="http://localhost/%s.rss" % pidx)
+            rows = [{'author': 'Author', 'episode_id': "%s-%s" % (pidx, eidx), 'link': 'http://localhost/',
+                     'podcast': podcast.id, 'published': datetime(2020, 1, 1) + timedelta(hours=eidx),
+                     'title': "Episode %s" % eidx} for eidx in range(episodes)]
+            for start in range(0, len(rows), 90):
+                Episode.insert_many(rows[start:start + 90]).execute()
+
+def update(stop, stats):
+    """ Write to the database the way an update does until told to stop
+
+        Args:
+            stop (Event): Set when the load test is over
+            stats (dict): Counts of the writes made
+
+    """
+    from podcastd import Podcast, Episode
+    from podcastd.base_model import db
+    podcasts = list(Podcast.select())
+    batch = 0
+    while not stop.is_set():
+        for podcast in podcasts:
+            if stop.is_set():
+                break
+            batch += 1
+            rows = [{'author': 'Author', 'episode_id': "new-%s-%s" % (batch, idx), 'link': 'http://localhost/',
+                     'podcast': podcast.id, 'published': datetime(2021, 1, 1) + timedelta(minutes=batch),
+                     'title': "New %s" % idx} for idx in range(50)]
+            try:
+                with db.atomic():
+                    Episode.insert_many(rows).execute()
+                for episode in podcast.pending_episodes():
+                    episode.status = 'downloaded'
+                    episode.save()
+                stats['writes'] += 1
+            except peewee.OperationalError:
+                stats['write_errors'] += 1
+
+def client(base_url, podcasts, stop, latencies, errors):
+    """ Issue GETs until told to stop
+
+        Args:
+            base_url (str): The server's URL
+            podcasts (int): The number of podcasts
+            stop (Event): Set when the load test is over
+            latencies (list): The latency of each successful request
+            errors (list): The errors
+
+    """
+    session = requests.Session()
+    idx = 0
+    while not stop.is_set():
+        idx += 1
+        url = "%s/episodes/%s?limit=100" % (base_url, idx % podcasts + 1)
+        if idx % 2:
+            url = "%s/podcasts" % base_url
+        start = time.perf_counter()
+        try:
+            response = session.get(url, timeout=30)
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+        except requests.exceptions.RequestException as err:
+            errors.append(str(err))
+
+def main():
+    """ Run the load test
+    """
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--legacy', action='store_true',
+                            help="Use a rollback journal and a single threaded server")
+    arg_parser.add_argument('--podcasts', type=int, default=20)
+    arg_parser.add_argument('--episodes', type=int, default=2000)
+    arg_parser.add_argument('--clients', type=int, default=8)
+    arg_parser.add_argument('--seconds', type=int, default=10)
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        load_settings(BASE_DIR=tmp_dir, LOGGING_FILE_PATH=os.path.join(tmp_dir, 'logs', 'log.txt'),
+                      logging_levels={'default': 'WARNING', 'werkzeug': 'ERROR'})
+        from podcastd.base_model import db, PRAGMAS
+        from podcastd.migrations import migrate_database
+        pragmas = dict(PRAGMAS, journal_mode='delete', busy_timeout=0) if args.legacy else PRAGMAS
+        db.init(os.path.join(tmp_dir, 'podcastd.db'), pragmas=pragmas)
+        migrate_database(db)
+        seed(args.podcasts, args.episodes)
+        db.close()
+
+        import app
+        server = make_server('127.0.0.1', 0, app.create_app(), threaded=not args.legacy)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = "http://127.0.0.1:%s" % server.server_port
+
+        stop = threading.Event()
+        stats = {'writes': 0, 'write_errors': 0}
+        latencies = []
+        errors = []
+        writer = threading.Thread(target=update, args=(stop, stats))
+        writer.start()
+        clients = [threading.Thread(target=client, args=(base_url, args.podcasts, stop, latencies, errors))
+                   for _idx in range(args.clients)]
+        for thread in clients:
+            thread.start()
+        time.sleep(args.seconds)
+        stop.set()
+        for thread in clients:
+            thread.join()
+        writer.join()
+        server.shutdown()
+
+    result = {'mode': 'legacy' if args.legacy else 'wal',
+              'requests': len(latencies),
+              'errors': len(errors),
+              'update_batches': stats['writes'],
+              'update_errors': stats['write_errors']}
+    for pct in (50, 95, 99, 100):
+        value = percentile(latencies, pct)
+        result["p%s_ms" % pct] = round(value * 1000, 1) if value is not None else None
+    print(json.dumps(result))
+
+if __name__ == '__main__':
+    main()
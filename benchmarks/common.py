@@ -0,0 +1,80 @@
+""" Shared set up for the benchmarks
+"""
+import os
+import sys
+import threading
+import types
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+sys.path.insert(0, REPO_DIR)
+
+def load_settings(**overrides):
+    """ Load settings.py, or settings.sample when there is none, as the settings module
+
+        Args:
+            overrides (dict): Settings to replace
+
+        Returns:
+            module: The settings
+    """
+    path = os.path.join(REPO_DIR, 'settings.py')
+    if not os.path.exists(path):
+        path = os.path.join(REPO_DIR, 'settings.sample')
+    settings = types.ModuleType('settings')
+    with open(path) as fileh:
+        exec(compile(fileh.read(), path, 'exec'), settings.__dict__) # pylint: disable=W0122
+    for key, value in overrides.items():
+        setattr(settings, key, value)
+    sys.modules['settings'] = settings
+    return settings
+
+def io_counters():
+    """ The bytes this process has read and written so far
+
+        Returns:
+            tuple: The bytes read and written, None if /proc is not available
+    """
+    counters = {}
+    try:
+        with open('/proc/self/io') as fileh:
+            for line in fileh:
+                key, _sep, value = line.partition(':')
+                counters[key] = int(value)
+    except OSError:
+        return None
+    return counters['rchar'], counters['wchar']
+
+def count_queries(database):
+    """ Count the statements a database executes
+
+        Args:
+            database (Database): The database
+
+        Returns:
+            callable: Returns the number of statements executed so far
+    """
+    count = [0]
+    lock = threading.Lock()
+    execute_sql = database.execute_sql
+
+    def counting(*args, **kwargs):
+        with lock:
+            count[0] += 1
+        return execute_sql(*args, **kwargs)
+    database.execute_sql = counting
+    return lambda: count[0]
+
+def percentile(values, pct):
+    """ Return a percentile of a list of values
+
+        Args:
+            values (list): The values
+            pct (float): The percentile, 0 to 100
+
+        Returns:
+            float: The value, None for an empty list
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
@@ -0,0 +1,265 @@
+""" A local stand in for podcast hosts
+
+    Serves generated RSS feeds and synthetic mp3s with embedded art, with
+    ETag and Range support. Each host listens on its own port, hosts can
+    be made slow or failing.
+
+    python benchmarks/feed_server.py --hosts 4 --slow-hosts 1 --failing-hosts 1
+"""
+import argparse
+import hashlib
+import sys
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qs, urlparse
+
+from PIL import Image
+
+from common import REPO_DIR  # pylint: disable=W0611
+from podcastd import tagging
+
+FRAME = b'\xff\xfb\x90\x64' + b'\x00' * 413
+
+def build_art(size, color):
+    """ Build a JPEG
+
+        Args:
+            size (int): The width and height
+            color (str): The fill color
+
+        Returns:
+            bytes: The JPEG
+    """
+    bytes_io = BytesIO()
+    Image.new('RGB', (size, size), color).save(bytes_io, 'JPEG')
+    return bytes_io.getvalue()
+
+def build_mp3(size):
+    """ Build an mp3 as published, with a tag and embedded art
+
+        Args:
+            size (int): The approximate size in bytes
+
+        Returns:
+            bytes: The mp3
+    """
+    frames = [tagging.text_frame('TIT2', 'As published'),
+              tagging.text_frame('TPE1', 'Publisher'),
+              tagging.image_frame(build_art(600, 'blue'))]
+    tag = tagging.render(frames, tagging.HEADER_SIZE + sum(len(x) for x in frames))
+    return tag + FRAME * max(1, (size - len(tag)) // len(FRAME))
+
+def build_feed(host, name, entries, newest):
+    """ Build an RSS feed, newest entry first, one entry an hour
+
+        Args:
+            host (str): The host the enclosures are served from
+            name (str): The name of the podcast
+            entries (int): The number of entries
+            newest (float): The publication time of the newest entry
+
+        Returns:
+            bytes: The feed
+    """
+    items = []
+    for idx in range(entries):
+        items.append('<item><title>%s episode %s</title><guid>%s-%s</guid><pubDate>%s</pubDate>'
+                     '<itunes:author>Publisher</itunes:author><description>Notes for %s</description>'
+                     '<enclosure url="http://%s/media/%s-%s.mp3" type="audio/mpeg" length="1"/></item>'
+                     % (name, idx, name, idx, formatdate(newest - idx * 3600), idx, host, name, idx))
+    return ('<?xml version="1.0"?><rss version="2.0" xmlns:itunes="http://www.itunes.com/dtds/podcast-1.0.dtd">'
+            '<channel><title>%s</title><itunes:image href="http://%s/art/%s.jpg"/>%s</channel></rss>'
+            % (name, host, name, ''.join(items))).encode()
+
+class Handler(BaseHTTPRequestHandler):
+    """ Serve feeds, art and media for one host
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args): # pylint: disable=W0221
+        pass
+
+    def do_HEAD(self): # pylint: disable=C0103
+        self.do_GET(head=True)
+
+    def do_GET(self, head=False): # pylint: disable=C0103,W0221
+        server = self.server.feed_server
+        behavior = self.server.behavior
+        server.count('requests')
+        if behavior['delay']:
+            time.sleep(behavior['delay'])
+        if behavior['failing']:
+            self.send(503, b'Unavailable', head)
+            return
+        url = urlparse(self.path)
+        if url.path.startswith('/feed/'):
+            name = url.path.split('/')[-1].rsplit('.', 1)[0]
+            entries = int(parse_qs(url.query).get('entries', [server.entries])[0])
+            body = server.feed(self.headers['Host'], name, entries)
+            content_type = 'application/rss+xml'
+        elif url.path.startswith('/art/'):
+            body, content_type = server.art, 'image/jpeg'
+        elif url.path.startswith('/media/'):
+            body, content_type = server.mp3, 'audio/mpeg'
+        else:
+            self.send(404, b'Not found', head)
+            return
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        if self.headers.get('If-None-Match') == etag:
+            server.count('not_modified')
+            self.send(304, b'', head, etag=etag)
+            return
+        start = 0
+        if self.headers.get('Range', '').startswith('bytes='):
+            start = int(self.headers['Range'][6:].split('-')[0] or 0)
+        self.send(206 if start else 200, body[start:], head, etag=etag, content_type=content_type,
+                  content_range="bytes %s-%s/%s" % (start, len(body) - 1, len(body)) if start else None)
+
+    def send(self, status, body, head, etag=None, content_type='text/plain', content_range=None):
+        """ Send a response
+
+            Args:
+                status (int): The status code
+                body (bytes): The body
+                head (bool): True to send only the headers
+                etag (str): The ETag
+                content_type (str): The content type
+                content_range (str): The Content-Range for a partial response
+
+        """
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Accept-Ranges', 'bytes')
+        if etag:
+            self.send_header('ETag', etag)
+        if content_range:
+            self.send_header('Content-Range', content_range)
+        self.end_headers()
+        if not head and status != 304:
+            self.wfile.write(body)
+            self.server.feed_server.count('bytes_sent', len(body))
+
+class Host(ThreadingHTTPServer):
+    """ A host, clients closing kept alive connections are not errors
+    """
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+class FeedServer:
+    """ A set of local hosts serving podcasts
+    """
+    def __init__(self, hosts=4, slow_hosts=0, failing_hosts=0, delay=0.5, entries=20, mp3_bytes=256 * 1024):
+        """ Init the server
+
+            Args:
+                hosts (int): The number of well behaved hosts
+                slow_hosts (int): The number of hosts that delay every response
+                failing_hosts (int): The number of hosts that fail every request
+                delay (float): The seconds a slow host waits before responding
+                entries (int): The default number of entries in a feed
+                mp3_bytes (int): The size of each mp3
+
+        """
+        self.entries = entries
+        self.newest = time.time() - 3600
+        self.art = build_art(1400, 'red')
+        self.mp3 = build_mp3(mp3_bytes)
+        self.behaviors = ([{'delay': 0, 'failing': False}] * hosts
+                          + [{'delay': delay, 'failing': False}] * slow_hosts
+                          + [{'delay': 0, 'failing': True}] * failing_hosts)
+        self.servers = []
+        self.counts = {'requests': 0, 'not_modified': 0, 'bytes_sent': 0}
+        self.feeds = {}
+        self.lock = threading.Lock()
+
+    def count(self, key, value=1):
+        """ Add to a count
+
+            Args:
+                key (str): The count
+                value (int): The amount
+
+        """
+        with self.lock:
+            self.counts[key] += value
+
+    def feed(self, host, name, entries):
+        """ Return a feed, built once so its ETag is stable
+
+            Args:
+                host (str): The host the enclosures are served from
+                name (str): The name of the podcast
+                entries (int): The number of entries
+
+            Returns:
+                bytes: The feed
+        """
+        key = host, name, entries
+        with self.lock:
+            if key not in self.feeds:
+                self.feeds[key] = build_feed(host, name, entries, self.newest)
+            return self.feeds[key]
+
+    def start(self):
+        """ Start a thread serving each host
+
+            Returns:
+                FeedServer: The server
+        """
+        for behavior in self.behaviors:
+            server = Host(('127.0.0.1', 0), Handler)
+            server.feed_server = self
+            server.behavior = behavior
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            self.servers.append(server)
+        return self
+
+    def stop(self):
+        """ Stop serving
+        """
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def feed_url(self, idx, entries=None):
+        """ The URL of a feed, feeds are spread across the hosts
+
+            Args:
+                idx (int): The number of the podcast
+                entries (int): The number of entries, the server's default if None
+
+            Returns:
+                str: The URL
+        """
+        port = self.servers[idx % len(self.servers)].server_port
+        query = "?entries=%s" % entries if entries else ""
+        return "http://127.0.0.1:%s/feed/show%s.rss%s" % (port, idx, query)
+
+def main():
+    """ Serve until interrupted
+    """
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--hosts', type=int, default=4)
+    arg_parser.add_argument('--slow-hosts', type=int, default=0)
+    arg_parser.add_argument('--failing-hosts', type=int, default=0)
+    arg_parser.add_argument('--entries', type=int, default=20)
+    args = arg_parser.parse_args()
+    server = FeedServer(hosts=args.hosts, slow_hosts=args.slow_hosts, failing_hosts=args.failing_hosts,
+                        entries=args.entries).start()
+    for idx in range(len(server.servers)):
+        print(server.feed_url(idx))
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == '__main__':
+    main()
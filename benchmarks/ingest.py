@@ -0,0 +1,109 @@
+""" Compare per entry and batched episode ingestion on a synthetic feed
+
+    python benchmarks/ingest.py --entries 1500
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from email.utils import formatdate
+
+import feedparser
+import pytz
+from dateutil import parser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from podcastd import Podcast, Episode  # pylint: disable=C0413
+from podcastd.base_model import BaseModel, db  # pylint: disable=C0413
+from podcastd.migrations import migrate_database  # pylint: disable=C0413
+
+def build_feed(entries):
+    """ Build a synthetic RSS feed
+
+        Args:
+            entries (int): The number of entries
+
+        Returns:
+            FeedParserDict: The parsed feed
+    """
+    items = []
+    for idx in range(entries):
+        items.append("<item><title>Episode %s</title><guid>episode-%s</guid>"
+                     "<pubDate>%s</pubDate>"
+                     "<enclosure url=\"http://localhost/%s.mp3\" type=\"audio/mpeg\" length=\"1\"/>"
+                     "</item>" % (idx, idx, formatdate(1500000000 - idx * 3600), idx))
+    xml = ("<?xml version=\"1.0\"?><rss version=\"2.0\"><channel><title>Synthetic</title>"
+           "<image><url>http://localhost/image.png</url></image>%s</channel></rss>" % "".join(items))
+    return feedparser.parse(xml)
+
+def legacy_ingest(podcast, feed):
+    """ The original ingestion, one query and one save per entry
+
+        Args:
+            podcast (Podcast): The podcast
+            feed (FeedParserDict): The parsed feed
+
+        Returns:
+            int: The number of episodes added
+    """
+    added = 0
+    feed_image = feed.feed.image.href
+    for episode in feed['entries']:
+        links = [x for x in episode['links'] if x['type'] == 'audio/mpeg']
+        published = parser.parse(episode['published'])
+        if published.tzinfo is None or published.tzinfo.utcoffset(published) is None:
+            published = pytz.utc.localize(published)
+        if links:
+            exists = Episode.select().where(Episode.episode_id == episode['id'])
+            if not exists:
+                entry = Episode(author=episode.get('author', podcast.name),
+                                episode_id=episode['id'],
+                                file_name=None,
+                                image=feed_image,
+                                link=links[0]['href'],
+                                podcast=podcast,
+                                published=published,
+                                status=None,
+                                title=episode['title'])
+                # The original save, without recording the change for the API
+                BaseModel.save(entry)
+                added += 1
+    return added
+
+def run(name, ingest, feed):
+    """ Time an ingestion into a fresh database, then again with every entry known
+
+        Args:
+            name (str): The name to report
+            ingest (callable): Called with the podcast and feed
+            feed (FeedParserDict): The parsed feed
+
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db.init(os.path.join(tmp_dir, 'podcastd.db'))
+        migrate_database(db)
+        podcast = Podcast(name='Synthetic', max_age='7d', max_episodes=3, url='http://localhost/rss')
+        podcast.save()
+        start = time.perf_counter()
+        added = ingest(podcast, feed)
+        first = time.perf_counter() - start
+        start = time.perf_counter()
+        ingest(podcast, feed)
+        second = time.perf_counter() - start
+        db.close()
+    print("%-8s added: %5d  empty db: %8.3fs  known entries: %8.3fs" % (name, added, first, second))
+
+def main():
+    """ Run the benchmark
+    """
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--entries', type=int, default=1500)
+    args = arg_parser.parse_args()
+    feed = build_feed(args.entries)
+    run('legacy', legacy_ingest, feed)
+    run('batched', lambda podcast, feed: podcast.ingest_feed(feed), feed)
+
+if __name__ == '__main__':
+    main()
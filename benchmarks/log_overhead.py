@@ -0,0 +1,110 @@
+""" Compare the cost of log calls with a handler per logger and with the queued pipeline
+
+    python benchmarks/log_overhead.py --calls 50000
+"""
+import argparse
+import copy
+import logging
+import os
+import sys
+import tempfile
+import time
+from logging.handlers import TimedRotatingFileHandler
+
+from common import load_settings
+
+def legacy_loggers(settings):
+    """ The original set up, a console and file handler on each logger
+        and a copy of each record made to color it
+
+        Args:
+            settings (obj): The settings
+
+    """
+    from podcastd.log import ColorFormatter, SimpleFormatter, stop_listener
+
+    class CopyingColorFormatter(ColorFormatter):
+        """ The original colored formatter
+        """
+        def format(self, record):
+            colored_record = copy.copy(record)
+            colored_record.app_name = self.app_name
+            colored_record.levelname_color = (self.COLORS[colored_record.levelname]
+                                              + colored_record.levelname + '\033[0m')
+            return logging.Formatter.format(self, colored_record)
+
+    def handlers():
+        console = logging.StreamHandler()
+        console.setLevel(settings.LOGGING_LEVEL_CONSOLE)
+        console.setFormatter(CopyingColorFormatter(app_name=settings.APP_NAME))
+        file_handler = TimedRotatingFileHandler(settings.LOGGING_FILE_PATH, when='d')
+        file_handler.setLevel(settings.LOGGING_LEVEL_FILE)
+        file_handler.setFormatter(SimpleFormatter(app_name=settings.APP_NAME))
+        return [console, file_handler]
+
+    stop_listener()
+    logging.getLogger().handlers = handlers()
+    logging.getLogger().setLevel(settings.logging_levels['default'])
+    for name, log_level in settings.logging_levels.items():
+        logging.getLogger(name).handlers = handlers()
+        logging.getLogger(name).setLevel(log_level)
+        logging.getLogger(name).propagate = False
+
+def queued_loggers(settings):
+    """ The queued pipeline
+
+        Args:
+            settings (obj): The settings
+
+    """
+    from podcastd.log import Logger
+    Logger(settings=settings).add_loggers()
+
+def run(name, set_up, settings, calls):
+    """ Time log calls that are written and log calls that are filtered
+
+        Args:
+            name (str): The name to report
+            set_up (callable): Called with the settings to configure logging
+            settings (obj): The settings
+            calls (int): The number of calls of each kind
+
+    """
+    from podcastd.log import stop_listener
+    set_up(settings)
+    logger = logging.getLogger('podcastd.episode')
+    start = time.perf_counter()
+    for idx in range(calls):
+        logger.debug("Downloading: %s", idx)
+    filtered = time.perf_counter() - start
+    start = time.perf_counter()
+    for idx in range(calls):
+        logger.info("Downloading: %s", idx)
+    written = time.perf_counter() - start
+    start = time.perf_counter()
+    stop_listener()
+    drained = time.perf_counter() - start
+    print("%-8s written: %7.2fus per call  filtered: %6.3fus per call  drained in %.3fs"
+          % (name, written / calls * 1e6, filtered / calls * 1e6, drained))
+
+def main():
+    """ Run the benchmark
+    """
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--calls', type=int, default=50000)
+    args = arg_parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp_dir, open(os.devnull, 'w') as devnull:
+        settings = load_settings(LOGGING_FILE_PATH=os.path.join(tmp_dir, 'logs', 'log.txt'),
+                                 LOGGING_LEVEL_CONSOLE='INFO', LOGGING_LEVEL_FILE='INFO',
+                                 logging_levels={'default': 'INFO', 'podcastd.episode': 'INFO'})
+        os.makedirs(os.path.dirname(settings.LOGGING_FILE_PATH))
+        # The console handlers write to stderr
+        sys.stderr = devnull
+        try:
+            for name, set_up in (('legacy', legacy_loggers), ('queued', queued_loggers)):
+                run(name, set_up, settings, args.calls)
+        finally:
+            sys.stderr = sys.__stderr__
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+""" Measure the database and the hot queries before and after archiving old episodes
+
+    python benchmarks/retention.py --podcasts 100 --episodes 2000
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import timedelta
+
+from common import load_settings
+
+DESCRIPTION = ' '.join(['show notes'] * 100)
+
+def seed(podcasts, episodes):
+    """ Fill the database with podcasts with a long history, one episode a day
+        Most were never downloaded, the rest were removed, but for the newest
+
+        Args:
+            podcasts (int): The number of podcasts
+            episodes (int): The number of episodes per podcast
+
+    """
+    from podcastd import Podcast, Episode
+    from podcastd.base_model import db
+    from podcastd.utils import utc_now
+    rand = random.Random(1)
+    now = utc_now().replace(microsecond=0)
+    with db.atomic():
+        for pidx in range(podcasts):
+            podcast = Podcast.create(name="Podcast %s" % pidx, max_age='30d', max_episodes=3,
+                                     url="http://localhost/%s.rss" % pidx)
+            rows = [{'author': "Host %s" % pidx, 'episode_id': "%s-%s" % (pidx, eidx),
+                     'description': DESCRIPTION, 'link': "http://localhost/%s/%s.mp3" % (pidx, eidx),
+                     'podcast': podcast.id, 'published': now - timedelta(days=eidx),
+                     'status': ('downloaded' if eidx < 3
+                                else 'removed' if rand.random() < 0.2 else None),
+                     'title': "Episode %s" % eidx}
+                    for eidx in range(episodes)]
+            for start in range(0, len(rows), 90):
+                Episode.insert_many(rows[start:start + 90]).execute()
+
+def measure(runs, client, feed_ids):
+    """ Time the queries that read a podcast's episodes
+
+        Args:
+            runs (int): The number of times to run each
+            client (FlaskClient): The API client
+            feed_ids (list): The GUIDs of a feed, for the ingest lookup
+
+        Returns:
+            dict: The median milliseconds of each
+    """
+    from podcastd import Podcast
+    podcast = Podcast.get_by_id(1)
+    results = {}
+    for name, func in (('known_episode_ids', lambda: Podcast.known_episode_ids(feed_ids)),
+                       ('pending_episodes', podcast.pending_episodes),
+                       ('remove_expired_episodes', podcast.remove_expired_episodes),
+                       ('publish_interval', podcast.publish_interval),
+                       ('GET /episodes/1', lambda: client.get('/episodes/1').get_data())):
+        seconds = []
+        for _idx in range(runs):
+            start = time.perf_counter()
+            func()
+            seconds.append(time.perf_counter() - start)
+        results[name] = round(statistics.median(seconds) * 1000, 2)
+    return results
+
+def main():
+    """ Run the benchmark
+    """
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--podcasts', type=int, default=100)
+    arg_parser.add_argument('--episodes', type=int, default=2000, help="Episodes per podcast")
+    arg_parser.add_argument('--runs', type=int, default=20)
+    args = arg_parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        load_settings(BASE_DIR=os.path.join(tmp_dir, 'Podcasts'),
+                      LOGGING_FILE_PATH=os.path.join(tmp_dir, 'logs', 'log.txt'),
+                      LOGGING_LEVEL_CONSOLE='WARNING', METRICS_ENABLED=False)
+        from podcastd.base_model import db
+        from podcastd.migrations import migrate_database
+        from podcastd.retention import Retention
+        db.init(os.path.join(tmp_dir, 'podcastd.db'))
+        migrate_database(db)
+        seed(args.podcasts, args.episodes)
+        import app
+        client = app.create_app().test_client()
+        # A feed lists its newest entries, a few of them new
+        feed_ids = ["1-%s" % idx for idx in range(-10, 290)]
+        before = measure(args.runs, client, feed_ids)
+        counts = Retention().run()
+        after = measure(args.runs, client, feed_ids)
+        print(json.dumps({'episodes': args.podcasts * args.episodes,
+                          'archived': counts['archived'],
+                          'seconds': counts['seconds'],
+                          'database': {'before': counts['before'], 'after': counts['after']},
+                          'ms': {'before': before, 'after': after}}, indent=2))
+        db.close()
+
+if __name__ == '__main__':
+    main()
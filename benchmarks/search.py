@@ -0,0 +1,108 @@
+""" Measure /search against pulling every podcast's episodes to filter them
+
+    python benchmarks/search.py --podcasts 100 --episodes 1000
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from common import count_queries, load_settings
+
+WORDS = ('climate', 'election', 'football', 'recipe', 'startup', 'history', 'science', 'music',
+         'interview', 'review', 'travel', 'health', 'finance', 'space', 'garden', 'comedy')
+# Show notes are drawn from a large vocabulary with a Zipf distribution, like real text
+VOCABULARY = ["word%s" % idx for idx in range(20000)]
+WEIGHTS = [1 / (idx + 1) for idx in range(len(VOCABULARY))]
+
+def seed(podcasts, episodes):
+    """ Fill the database with podcasts and episodes with show notes, each
+        title and podcast name has one of WORDS
+
+        Args:
+            podcasts (int): The number of podcasts
+            episodes (int): The number of episodes per podcast
+
+    """
+    from podcastd import Podcast, Episode
+    from podcastd.base_model import db
+    rand = random.Random(1)
+    with db.atomic():
+        for pidx in range(podcasts):
+            podcast = Podcast.create(name="Podcast %s %s" % (rand.choice(WORDS), pidx), max_age='7d',
+                                     max_episodes=3, url="http://localhost/%s.rss" % pidx)
+            rows = [{'author': "Host %s" % pidx, 'episode_id': "%s-%s" % (pidx, eidx),
+                     'link': 'http://localhost/', 'podcast': podcast.id,
+                     'published': datetime(2020, 1, 1) + timedelta(hours=eidx),
+                     'title': "Episode %s about %s" % (eidx, rand.choice(WORDS)),
+                     'description': ' '.join(rand.choices(VOCABULARY, WEIGHTS, k=60))}
+                    for eidx in range(episodes)]
+            for start in range(0, len(rows), 90):
+                Episode.insert_many(rows[start:start + 90]).execute()
+
+def timed(client, url):
+    """ Time a GET
+
+        Args:
+            client (FlaskClient): The client
+            url (str): The URL
+
+        Returns:
+            tuple: The seconds taken and the body
+    """
+    start = time.perf_counter()
+    body = client.get(url).get_data()
+    return time.perf_counter() - start, body
+
+def main():
+    """ Run the benchmark
+    """
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--podcasts', type=int, default=100)
+    arg_parser.add_argument('--episodes', type=int, default=1000, help="Episodes per podcast")
+    arg_parser.add_argument('--runs', type=int, default=20)
+    args = arg_parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        load_settings(BASE_DIR=os.path.join(tmp_dir, 'Podcasts'),
+                      LOGGING_FILE_PATH=os.path.join(tmp_dir, 'logs', 'log.txt'),
+                      LOGGING_LEVEL_CONSOLE='WARNING', METRICS_ENABLED=False)
+        from podcastd.base_model import db
+        from podcastd.migrations import migrate_database
+        db.init(os.path.join(tmp_dir, 'podcastd.db'))
+        migrate_database(db)
+        start = time.perf_counter()
+        seed(args.podcasts, args.episodes)
+        seed_seconds = time.perf_counter() - start
+        import app
+        client = app.create_app().test_client()
+        queries = count_queries(db)
+        results = []
+        for name, url in (('word', '/search?q=climate'),
+                          ('two words', '/search?q=climate+review&limit=50'),
+                          ('prefix', '/search?q=fin*'),
+                          ('show notes', '/search?q=word500'),
+                          ('podcast name', '/search?q=podcast+garden&status=none'),
+                          ('next page', None)):
+            if url is None:
+                url = client.get('/search?q=climate').headers['Link'][1:].split('>')[0]
+            before = queries()
+            runs = [timed(client, url) for _idx in range(args.runs)]
+            results.append({'query': name,
+                             'ms': round(statistics.median(x[0] for x in runs) * 1000, 2),
+                             'queries': (queries() - before) // args.runs,
+                             'results': len(json.loads(runs[0][1])),
+                             'bytes': len(runs[0][1])})
+        seconds, body = timed(client, '/episodes/1')
+        results.append({'query': 'one podcast\'s /episodes', 'ms': round(seconds * 1000, 2),
+                        'results': len(json.loads(body)), 'bytes': len(body)})
+        print(json.dumps({'episodes': args.podcasts * args.episodes,
+                          'seed_seconds': round(seed_seconds, 1),
+                          'results': results}, indent=2))
+        db.close()
+
+if __name__ == '__main__':
+    main()
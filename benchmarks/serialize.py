@@ -0,0 +1,91 @@
+""" Measure the throughput of /episodes/<id> on a large show
+
+    Serving a show's episodes must take a fixed number of queries however
+    many episodes it has, the benchmark fails if it does not. --legacy
+    serializes each row with model_to_dict for comparison.
+
+    python benchmarks/serialize.py --episodes 10000
+    python benchmarks/serialize.py --episodes 10000 --legacy
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from common import count_queries, load_settings
+
+MAX_QUERIES = 3
+
+def seed(episodes):
+    """ Fill the database with a show
+
+        Args:
+            episodes (int): The number of episodes
+
+        Returns:
+            int: The id of the show
+    """
+    from podcastd import Podcast, Episode
+    from podcastd.base_model import db
+    with db.atomic():
+        podcast = Podcast.create(name="Show", max_age='7d', max_episodes=3, url="http://localhost/show.rss",
+                                 last_refreshed=datetime(2020, 1, 1))
+        rows = [{'author': 'Author', 'episode_id': "ep-%s" % idx, 'link': 'http://localhost/',
+                 'podcast': podcast.id, 'published': datetime(2020, 1, 1) + timedelta(hours=idx),
+                 'title': "Episode %s" % idx} for idx in range(episodes)]
+        for start in range(0, len(rows), 90):
+            Episode.insert_many(rows[start:start + 90]).execute()
+    return podcast.id
+
+def legacy():
+    """ Serialize each row with model_to_dict, as before
+    """
+    from playhouse.shortcuts import model_to_dict
+    from podcastd import api
+    api.serialize = lambda model, query, **_kwargs: (model_to_dict(x) for x in query.iterator())
+
+def main():
+    """ Run the benchmark
+    """
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--episodes', type=int, default=10000)
+    arg_parser.add_argument('--requests', type=int, default=10)
+    arg_parser.add_argument('--legacy', action='store_true', help="Serialize each row with model_to_dict")
+    args = arg_parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        load_settings(BASE_DIR=os.path.join(tmp_dir, 'Podcasts'),
+                      LOGGING_FILE_PATH=os.path.join(tmp_dir, 'logs', 'log.txt'),
+                      LOGGING_LEVEL_CONSOLE='WARNING', METRICS_ENABLED=False)
+        from podcastd.base_model import db
+        from podcastd.migrations import migrate_database
+        db.init(os.path.join(tmp_dir, 'podcastd.db'))
+        migrate_database(db)
+        podcast_id = seed(args.episodes)
+        import app
+        if args.legacy:
+            legacy()
+        client = app.create_app().test_client()
+        queries = count_queries(db)
+        before = queries()
+        body = client.get('/episodes/%s' % podcast_id).get_data()
+        used = queries() - before
+        rows = json.loads(body)
+        assert len(rows) == args.episodes, "Expected %s episodes, got %s" % (args.episodes, len(rows))
+        start = time.perf_counter()
+        for _idx in range(args.requests):
+            body = client.get('/episodes/%s' % podcast_id).get_data()
+        seconds = (time.perf_counter() - start) / args.requests
+        print(json.dumps({'mode': 'legacy' if args.legacy else 'joined',
+                          'episodes': args.episodes,
+                          'queries': used,
+                          'ms_per_request': round(seconds * 1000, 1),
+                          'episodes_per_second': round(args.episodes / seconds),
+                          'bytes': len(body)}))
+        if not args.legacy:
+            assert used <= MAX_QUERIES, "/episodes took %s queries, expected at most %s" % (used, MAX_QUERIES)
+        db.close()
+
+if __name__ == '__main__':
+    main()
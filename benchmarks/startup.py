@@ -0,0 +1,77 @@
+""" Measure the import time and memory of each way podcastd starts
+
+    Each mode is imported in a fresh interpreter. The eager modes also
+    import the modules that used to be imported up front, to show what
+    importing them lazily saves.
+
+    python benchmarks/startup.py --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HEAVY = ('flask', 'feedparser', 'eyed3', 'PIL', 'requests')
+EAGER = 'import feedparser, eyed3.id3, PIL.Image'
+MODES = {'update': 'import podcastd.__main__, podcastd.scheduler, podcastd.migrations',
+         'update (eager)': 'import podcastd.__main__, podcastd.scheduler, podcastd.migrations; ' + EAGER,
+         'serve': 'import app; app.create_app()',
+         'serve (eager)': 'import app; app.create_app(); ' + EAGER}
+
+SNIPPET = """
+import json, os, resource, sys, time
+sys.path.insert(0, %(benchmarks)r)
+from common import load_settings
+load_settings(LOGGING_FILE_PATH=os.path.join(%(tmp_dir)r, 'logs', 'log.txt'))
+start = time.perf_counter()
+%(imports)s
+seconds = time.perf_counter() - start
+print(json.dumps({'import_seconds': seconds,
+                  'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+                  'loaded': [x for x in %(heavy)r if x in sys.modules]}))
+os._exit(0)
+"""
+
+def measure(imports, tmp_dir):
+    """ Import modules in a fresh interpreter
+
+        Args:
+            imports (str): The import statements
+            tmp_dir (str): A scratch directory for the log file
+
+        Returns:
+            dict: The import time, peak RSS, heavy modules loaded and the seconds until exit
+    """
+    code = SNIPPET % {'benchmarks': os.path.dirname(os.path.realpath(__file__)), 'tmp_dir': tmp_dir,
+                      'imports': imports, 'heavy': HEAVY}
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', code], cwd=tmp_dir, check=True,
+                            stdout=subprocess.PIPE).stdout
+    result = json.loads(output.decode().strip().splitlines()[-1])
+    result['process_seconds'] = time.perf_counter() - start
+    return result
+
+def main():
+    """ Run the benchmark
+    """
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--runs', type=int, default=5)
+    args = arg_parser.parse_args()
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for mode, imports in MODES.items():
+            runs = [measure(imports, tmp_dir) for _idx in range(args.runs)]
+            results.append({'mode': mode,
+                            'import_ms': round(statistics.median(x['import_seconds'] for x in runs) * 1000, 1),
+                            'process_ms': round(statistics.median(x['process_seconds'] for x in runs) * 1000, 1),
+                            'peak_rss_mb': round(max(x['peak_rss_bytes'] for x in runs) / 1024 / 1024, 1),
+                            'loaded': runs[0]['loaded']})
+    for result in results:
+        print(json.dumps(result))
+
+if __name__ == '__main__':
+    main()
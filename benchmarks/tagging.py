@@ -0,0 +1,112 @@
+""" Compare bytes read and written by the eyed3 retagging and the single pass tagger
+
+    python benchmarks/tagging.py --size-mb 100
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from eyed3 import id3
+
+from common import io_counters
+from podcastd import tagging
+
+VALID_ID3S = [id3.ID3_V1, id3.ID3_V1_0, id3.ID3_V1_1, id3.ID3_V2_3, id3.ID3_V2_4]
+IMAGE = b'\xff\xd8\xff\xe0' + b'\x00' * 30000
+
+def build_episode(file_name, size_mb):
+    """ Build a synthetic episode as published, with a small v2.4 tag and a v1 trailer
+
+        Args:
+            file_name (str): The file name
+            size_mb (int): The size of the audio in MB
+
+    """
+    frame = b'\xff\xfb\x90\x64' + b'\x00' * 413
+    with open(file_name, 'wb') as fileh:
+        for _idx in range(size_mb * 1024 * 1024 // len(frame)):
+            fileh.write(frame)
+    tag = id3.Tag()
+    tag.title = 'As published'
+    tag.artist = 'Publisher'
+    tag.save(filename=file_name, version=id3.ID3_V2_4)
+    tag.save(filename=file_name, version=id3.ID3_V1_1)
+
+def legacy_tag(file_name):
+    """ The original eyed3 clear and save of every tag version
+
+        Args:
+            file_name (str): The file name
+
+    """
+    current_tag = id3.Tag()
+    for entry in VALID_ID3S:
+        current_tag.parse(file_name, version=entry)
+        current_tag.clear()
+        current_tag.save(filename=file_name, version=entry)
+    new_tag = id3.Tag()
+    new_tag.artist = 'Author'
+    new_tag.album_artist = 'Author'
+    new_tag.title = 'Episode'
+    new_tag.album = 'Podcast'
+    new_tag.genre = id3.Genre(id=255, name=u"Podcast")
+    new_tag.images.set(3, IMAGE, 'image/jpeg', '')
+    new_tag.save(filename=file_name, version=id3.ID3_V2_3)
+
+def single_pass_tag(file_name):
+    """ The single pass tagger
+
+        Args:
+            file_name (str): The file name
+
+    """
+    frames = [tagging.text_frame('TPE1', 'Author'),
+              tagging.text_frame('TPE2', 'Author'),
+              tagging.text_frame('TIT2', 'Episode'),
+              tagging.text_frame('TALB', 'Podcast'),
+              tagging.text_frame('TCON', '(255)Podcast'),
+              tagging.image_frame(IMAGE)]
+    tagging.write_tag(file_name, frames)
+
+def run(name, tag, source, tmp_dir):
+    """ Tag a copy of the synthetic episode twice, as a new and a retagged file
+
+        Args:
+            name (str): The name to report
+            tag (callable): Called with the file name
+            source (str): The synthetic episode
+            tmp_dir (str): A scratch directory
+
+    """
+    file_name = os.path.join(tmp_dir, "%s.mp3" % name)
+    shutil.copyfile(source, file_name)
+    for label in ('new', 'retag'):
+        before = io_counters()
+        start = time.perf_counter()
+        tag(file_name)
+        seconds = time.perf_counter() - start
+        after = io_counters()
+        if before and after:
+            read, written = [(end - begin) / 1024 / 1024 for begin, end in zip(before, after)]
+        else:
+            read = written = float('nan')
+        print("%-12s %-6s %8.1f MB read %8.1f MB written %8.3fs"
+              % (name, label, read, written, seconds))
+
+def main():
+    """ Run the benchmark
+    """
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--size-mb', type=int, default=100)
+    args = arg_parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        source = os.path.join(tmp_dir, 'source.mp3')
+        build_episode(source, args.size_mb)
+        print("episode: %.1f MB" % (os.path.getsize(source) / 1024 / 1024))
+        run('eyed3', legacy_tag, source, tmp_dir)
+        run('single-pass', single_pass_tag, source, tmp_dir)
+
+if __name__ == '__main__':
+    main()
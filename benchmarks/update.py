@@ -0,0 +1,135 @@
+""" Time full updates against local synthetic podcast hosts
+
+    Each number of subscriptions is run in its own process, against a fresh
+    database and BASE_DIR, first with nothing downloaded and then again with
+    every feed unchanged. The results are printed as JSON.
+
+    python benchmarks/update.py
+    python benchmarks/update.py --subscriptions 10 100 --output before.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import REPO_DIR, count_queries, io_counters, load_settings
+from feed_server import FeedServer
+
+def directory_bytes(path):
+    """ The size of the files in a directory
+
+        Args:
+            path (str): The directory
+
+        Returns:
+            int: The total size in bytes
+    """
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _dirs, names in os.walk(path) for name in names)
+
+def run_scale(args):
+    """ Subscribe to podcasts on the synthetic hosts and update them twice
+
+        Args:
+            args (Namespace): The arguments
+
+        Returns:
+            dict: The results
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        settings = load_settings(BASE_DIR=os.path.join(tmp_dir, 'Podcasts'),
+                                 LOGGING_FILE_PATH=os.path.join(tmp_dir, 'logs', 'log.txt'),
+                                 ARTWORK_CACHE_DIR=os.path.join(tmp_dir, 'artwork'),
+                                 ADAPTIVE_POLLING=False, TAG_WORKERS=args.tag_workers,
+                                 DEDUPE_DOWNLOADS=args.dedupe)
+        from podcastd import Podcast, Updater
+        from podcastd.base_model import db
+        from podcastd.migrations import migrate_database
+        db.init(os.path.join(tmp_dir, 'podcastd.db'))
+        migrate_database(db)
+        server = FeedServer(hosts=args.hosts, slow_hosts=args.slow_hosts, failing_hosts=args.failing_hosts,
+                            delay=args.delay, entries=args.entries, mp3_bytes=args.mp3_kb * 1024).start()
+        with db.atomic():
+            for idx in range(args.scale):
+                podcast = Podcast.create(name="Show %s" % idx, max_age='7d', max_episodes=args.max_episodes,
+                                         url=server.feed_url(idx))
+                podcast.build_directory(base_dir=settings.BASE_DIR)
+        queries = count_queries(db)
+        runs = []
+        for name in ('cold', 'unchanged'):
+            requests_before = dict(server.counts)
+            queries_before = queries()
+            io_before = io_counters()
+            start = time.perf_counter()
+            totals = Updater(settings=settings).run()
+            seconds = time.perf_counter() - start
+            io_after = io_counters()
+            runs.append({'run': name,
+                         'seconds': round(seconds, 3),
+                         'requests': server.counts['requests'] - requests_before['requests'],
+                         'not_modified': server.counts['not_modified'] - requests_before['not_modified'],
+                         'bytes_received': server.counts['bytes_sent'] - requests_before['bytes_sent'],
+                         'bytes_written': io_after[1] - io_before[1] if io_before and io_after else None,
+                         'db_queries': queries() - queries_before,
+                         'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+                         'totals': totals})
+        server.stop()
+        result = {'subscriptions': args.scale,
+                  'files_bytes': directory_bytes(settings.BASE_DIR),
+                  'runs': runs}
+        db.close()
+    return result
+
+def main():
+    """ Run the benchmark
+    """
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--subscriptions', type=int, nargs='+', default=[10, 100, 1000])
+    arg_parser.add_argument('--hosts', type=int, default=8)
+    arg_parser.add_argument('--slow-hosts', type=int, default=1)
+    arg_parser.add_argument('--failing-hosts', type=int, default=1)
+    arg_parser.add_argument('--delay', type=float, default=0.2, help="Seconds a slow host waits")
+    arg_parser.add_argument('--entries', type=int, default=20, help="Entries in each feed")
+    arg_parser.add_argument('--max-episodes', type=int, default=3)
+    arg_parser.add_argument('--mp3-kb', type=int, default=64)
+    arg_parser.add_argument('--tag-workers', type=int, default=2, help="Processes tagging, 0 for a thread")
+    arg_parser.add_argument('--dedupe', action='store_true',
+                            help="Reuse downloads, every synthetic enclosure is the same mp3")
+    arg_parser.add_argument('--output', help="Also write the results to this file")
+    arg_parser.add_argument('--scale', type=int, help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+
+    if args.scale:
+        logging.basicConfig(level=logging.CRITICAL)
+        print(json.dumps(run_scale(args)))
+        return
+
+    results = []
+    for scale in args.subscriptions:
+        command = [sys.executable, os.path.realpath(__file__), '--scale', str(scale)]
+        for name in ('hosts', 'slow_hosts', 'failing_hosts', 'delay', 'entries', 'max_episodes', 'mp3_kb', 'tag_workers'):
+            command += ['--%s' % name.replace('_', '-'), str(getattr(args, name))]
+        if args.dedupe:
+            command.append('--dedupe')
+        output = subprocess.run(command, check=True, stdout=subprocess.PIPE).stdout
+        results.append(json.loads(output.decode().strip().splitlines()[-1]))
+    commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.decode().strip()
+    report = {'commit': commit or None,
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'options': {x: y for x, y in vars(args).items() if x not in ('output', 'scale')},
+              'results': results}
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as fileh:
+            json.dump(report, fileh, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -3,12 +3,13 @@ import yaml
 
 def load():
     with open('podcasts.yml', 'r') as stream:
-        podcasts = yaml.load(stream)
-    for name, details in podcasts.items():
-        details.update({"name": name})
-        print(name)
-        response = requests.post("http://localhost:5000/podcast", json=details)
-        print(response.text)
+        podcasts = yaml.safe_load(stream)
+    response = requests.post("http://localhost:5000/podcasts/import", json=podcasts)
+    result = response.json()
+    for podcast in result.get('podcasts', []):
+        print(podcast['name'], podcast['status'], podcast.get('error', ''))
+    print(response.text if 'error' in result else
+          "Added: %s, Duplicate: %s, Invalid: %s" % (result['added'], result['duplicate'], result['invalid']))
 
 def main():
     load()
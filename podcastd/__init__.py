@@ -1,4 +1,7 @@
 from .podcast import Podcast
 from .episode import Episode
 from .base_model import BaseModel
+from .revision import Revision
 from .utils import DateTimeEncoder
+from .updater import Updater
+from .scheduler import Scheduler
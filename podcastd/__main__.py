@@ -0,0 +1,112 @@
+""" The podcastd command line
+
+    python -m podcastd update [podcast ids] [--all]
+    python -m podcastd serve
+    python -m podcastd sync [target] [--fsync-every N]
+    python -m podcastd compact [--report]
+
+    Only the modules a command needs are imported, a one shot update
+    never loads Flask.
+"""
+import argparse
+import json
+
+
+def update(args, settings):
+    """ Create the tables if needed, update the podcasts and print the totals
+
+        Args:
+            args (Namespace): The arguments
+            settings (obj): The settings
+
+    """
+    from .base_model import db
+    from .migrations import migrate_database
+    from .scheduler import run_update
+    migrate_database(db)
+    # --all is a full update, reported to Slack, that ignores when podcasts are due
+    totals = run_update(settings, podcast_ids=args.podcasts or None, force=args.all)
+    db.close()
+    print(json.dumps(totals))
+
+def serve(args, settings): # pylint: disable=W0613
+    """ Serve the API
+
+        Args:
+            args (Namespace): The arguments
+            settings (obj): The settings
+
+    """
+    import app
+    app.main()
+
+def sync(args, settings):
+    """ Sync the downloaded episodes to a player
+
+        Args:
+            args (Namespace): The arguments
+            settings (obj): The settings
+
+    """
+    from .sync import Sync, resolve_target
+    fsync_every = args.fsync_every
+    if fsync_every is None:
+        fsync_every = getattr(settings, 'SYNC_FSYNC_EVERY', 0)
+    counts = Sync(base_dir=settings.BASE_DIR, target=resolve_target(settings, args.target),
+                  fsync_every=fsync_every).run()
+    print(json.dumps(counts))
+
+def compact(args, settings):
+    """ Archive old episodes and vacuum the database, printing the report
+
+        Args:
+            args (Namespace): The arguments
+            settings (obj): The settings
+
+    """
+    from .base_model import db
+    from .migrations import migrate_database
+    from .retention import Retention, report
+    migrate_database(db)
+    counts = report() if args.report else Retention.from_settings(settings).run()
+    db.close()
+    print(json.dumps(counts))
+
+def main(argv=None):
+    """ Run a command
+
+        Args:
+            argv (list): The arguments, defaults to sys.argv
+
+    """
+    arg_parser = argparse.ArgumentParser(prog='python -m podcastd')
+    commands = arg_parser.add_subparsers(dest='command', required=True)
+    update_parser = commands.add_parser('update', help="Update the podcasts that are due, then exit")
+    update_parser.add_argument('podcasts', nargs='*', type=int, help="Only update the podcasts with these ids")
+    update_parser.add_argument('--all', action='store_true', help="Update every podcast, due or not")
+    update_parser.set_defaults(func=update)
+    serve_parser = commands.add_parser('serve', help="Serve the API")
+    serve_parser.set_defaults(func=serve)
+    sync_parser = commands.add_parser('sync', help="Sync the downloaded episodes to a player")
+    sync_parser.add_argument('target', nargs='?', help="A name from SYNC_TARGETS or a directory")
+    sync_parser.add_argument('--fsync-every', type=int,
+                             help="Flush to the player after this many copies, 0 to leave it to the OS")
+    sync_parser.set_defaults(func=sync)
+    compact_parser = commands.add_parser('compact', help="Archive old episodes and vacuum the database")
+    compact_parser.add_argument('--report', action='store_true',
+                                help="Only report the database's size and episodes")
+    compact_parser.set_defaults(func=compact)
+    args = arg_parser.parse_args(argv)
+
+    import settings
+    from .log import Logger
+    from .sync import SyncError
+    if args.command != 'serve':
+        Logger(settings=settings).add_loggers()
+    try:
+        args.func(args, settings)
+    except SyncError as err:
+        arg_parser.exit(1, "%s\n" % err)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+""" Helpers for the JSON API collections
+"""
+import json
+from urllib.parse import urlencode
+
+from flask import Response
+
+from .podcast import FETCH_STATE_FIELDS
+from .revision import Revision
+from .serialize import columns, serialize
+from .utils import DateTimeEncoder
+
+DEFAULT_LIMIT = None
+MAX_LIMIT = 1000
+
+def collection_etag(collection):
+    """ Build the ETag for a collection from its change counter
+
+        Args:
+            collection (str): The collection
+
+        Returns:
+            str: The ETag, unquoted
+    """
+    return '%s-%s' % (collection, Revision.current(collection))
+
+def not_modified(request, etag):
+    """ Determine if a client already has the current version of a collection
+
+        Args:
+            request (Request): The flask request
+            etag (str): The current ETag, unquoted
+
+        Returns:
+            bool: True if the client's If-None-Match matches
+    """
+    return request.if_none_match.contains_weak(etag)
+
+def parse_fields(model, value, exclude=()):
+    """ Parse a comma separated list of field names
+
+        Args:
+            model (Model): The model
+            value (str): The field names, None for all fields
+            exclude (tuple): The names of fields that can not be selected
+
+        Returns:
+            list: The fields, None for all fields
+    """
+    if not value:
+        return None
+    fields = []
+    for name in value.split(','):
+        if name not in model._meta.fields or name in exclude: # pylint: disable=W0212
+            raise ValueError("Unknown field: %s" % name)
+        fields.append(model._meta.fields[name]) # pylint: disable=W0212
+    return fields
+
+def filter_status(model, query, value):
+    """ Filter a query by a comma separated list of statuses
+
+        Args:
+            model (Model): The model
+            query (Select): The query
+            value (str): The statuses, 'none' matches a status that is not set
+
+        Returns:
+            Select: The query
+    """
+    if not value:
+        return query
+    if 'status' not in model._meta.fields: # pylint: disable=W0212
+        raise ValueError("%s can not be filtered by status" % model._meta.table_name) # pylint: disable=W0212
+    statuses = value.split(',')
+    clause = model.status.in_([x for x in statuses if x != 'none'])
+    if 'none' in statuses:
+        clause = clause | model.status.is_null()
+    return query.where(clause)
+
+def parse_limit(value):
+    """ Parse the page size
+
+        Args:
+            value (str): The page size, None for no limit
+
+        Returns:
+            int: The page size
+    """
+    if value is None:
+        return DEFAULT_LIMIT
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError("Invalid limit: %s" % value)
+    if limit < 1:
+        raise ValueError("Invalid limit: %s" % value)
+    return min(limit, MAX_LIMIT)
+
+def page(model, query, args):
+    """ Apply the keyset paging and projection requested to a query
+
+        Args:
+            model (Model): The model
+            query (Select): The query
+            args (dict): The request arguments, after, limit and fields
+
+        Returns:
+            tuple: The rows as dicts and the cursor for the next page or None,
+                the rows are only read as they are consumed when there is no limit
+    """
+    fields = parse_fields(model, args.get('fields'), exclude=FETCH_STATE_FIELDS)
+    limit = parse_limit(args.get('limit'))
+    after = args.get('after')
+    if after is not None:
+        if not after.isdigit():
+            raise ValueError("Invalid cursor: %s" % after)
+        query = query.where(model.id > int(after))
+    query = query.order_by(model.id)
+    if limit:
+        query = query.limit(limit)
+    if fields is None:
+        rows = serialize(model, query, exclude=FETCH_STATE_FIELDS)
+    else:
+        rows = query.select(model.id, *columns(fields, alias=True)).dicts().iterator()
+    cursor = None
+    if limit:
+        rows = list(rows)
+        if len(rows) == limit:
+            cursor = rows[-1]['id']
+    if fields is not None and 'id' not in [x.name for x in fields]:
+        rows = ({key: value for key, value in row.items() if key != 'id'} for row in rows)
+    return rows, cursor
+
+def next_link(request, cursor):
+    """ Build the Link header for the next page
+
+        Args:
+            request (Request): The flask request
+            cursor (int): The id of the last row on this page
+
+        Returns:
+            str: The Link header
+    """
+    args = request.args.to_dict()
+    args['after'] = cursor
+    return '<%s?%s>; rel="next"' % (request.base_url, urlencode(args))
+
+def respond(request, collection, model, query):
+    """ Build a streamed, paged response for a collection
+
+        Args:
+            request (Request): The flask request
+            collection (str): The collection, used for the ETag
+            model (Model): The model
+            query (Select): The query for the whole collection
+
+        Returns:
+            Response: The response
+    """
+    etag = collection_etag(collection)
+    if not_modified(request, etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    try:
+        query = filter_status(model, query, request.args.get('status'))
+        rows, cursor = page(model, query, request.args)
+    except ValueError as err:
+        return Response(json.dumps({"error": str(err)}), status=400, mimetype='application/json')
+    response = Response(stream_json(rows), mimetype='application/json')
+    response.set_etag(etag)
+    if cursor is not None:
+        response.headers['Link'] = next_link(request, cursor)
+    return response
+
+def stream_json(rows):
+    """ Serialize a list of rows a row at a time
+
+        Args:
+            rows (list): The rows
+
+        Yields:
+            str: The next chunk of the JSON array
+    """
+    yield '['
+    for idx, row in enumerate(rows):
+        yield (',' if idx else '') + json.dumps(row, cls=DateTimeEncoder)
+    yield ']'
@@ -0,0 +1,246 @@
+""" The artwork cache
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from io import BytesIO
+
+from . import http_client, metrics
+
+ARTWORK_SIZE = 400, 400
+
+def resize(data):
+    """ Resize an image for embedding in the id3 tags
+
+        Args:
+            data (bytes): The source image
+
+        Returns:
+            bytes: The image as a JPEG, at most 400x400px
+    """
+    # Pillow is only imported once there is an image to resize
+    from PIL import Image
+    with metrics.PHASE_SECONDS.time(phase='image_resize'):
+        image = Image.open(BytesIO(data))
+        # A JPEG is decoded at the smallest scale still larger than the artwork
+        image.draft('RGB', ARTWORK_SIZE)
+        image.thumbnail(ARTWORK_SIZE, Image.LANCZOS)
+        image = image.convert('RGB')
+        bytes_io = BytesIO()
+        image.save(bytes_io, "JPEG")
+        return bytes_io.getvalue()
+
+class ArtworkCache:
+    """ A size limited cache of resized artwork
+
+        Resized JPEGs are stored on disk named by the hash of their content,
+        an index maps each source URL to its JPEG along with the HTTP
+        validators it was fetched with. The least recently used JPEGs are
+        evicted once the cache grows beyond max_bytes. Everything handed out
+        during the life of the instance is also kept in memory.
+
+        Artwork that is not cached is returned as its source image, to be
+        resized by the tag stage and stored once it has been.
+    """
+    def __init__(self, cache_dir, max_bytes, revalidate=None, logger=None):
+        """ Init the cache
+
+            Args:
+                cache_dir (str): The directory to store the artwork in
+                max_bytes (int): The maximum size of the artwork on disk
+                revalidate (int): Seconds before a source URL is checked again,
+                    None to never check again
+
+        """
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_bytes = max_bytes
+        self.revalidate = revalidate
+        self.logger = logger or logging.getLogger(__name__)
+        self.index_path = os.path.join(self.cache_dir, 'index.json')
+        self.memory = {}
+        # The source images fetched but not yet resized and stored, with their validators
+        self.sources = {}
+        self.lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.index = self.load_index()
+
+    @classmethod
+    def from_settings(cls, settings):
+        """ Build a cache from the settings
+
+            Args:
+                settings (obj): The settings
+
+            Returns:
+                ArtworkCache: The cache
+        """
+        return cls(cache_dir=getattr(settings, 'ARTWORK_CACHE_DIR', './cache/artwork'),
+                   max_bytes=getattr(settings, 'ARTWORK_CACHE_MAX_BYTES', 50 * 1024 * 1024),
+                   revalidate=getattr(settings, 'ARTWORK_CACHE_REVALIDATE', None))
+
+    def load_index(self):
+        """ Load the index from disk
+
+            Returns:
+                dict: The index entry for each source URL
+        """
+        try:
+            with open(self.index_path) as fileh:
+                return json.load(fileh)
+        except (OSError, ValueError):
+            return {}
+
+    def save_index(self):
+        """ Write the index to disk
+        """
+        tmp_path = "%s.tmp" % self.index_path
+        with open(tmp_path, 'w') as fileh:
+            json.dump(self.index, fileh)
+        os.replace(tmp_path, self.index_path)
+
+    def path(self, digest):
+        """ Return the path to a cached JPEG
+
+            Args:
+                digest (str): The hash of the JPEG
+
+            Returns:
+                str: The path
+        """
+        return os.path.join(self.cache_dir, "%s.jpg" % digest)
+
+    def get(self, url):
+        """ Get the artwork for a URL
+
+            Args:
+                url (str): The URL of the source image
+
+            Returns:
+                tuple: The resized JPEG, or None and the source image
+                    when it has still to be resized
+        """
+        if url in self.memory:
+            return self.memory[url], None
+        with self.lock:
+            if url in self.sources:
+                return None, self.sources[url][0]
+            entry = self.index.get(url)
+            data = self.read(entry)
+            if data is not None and not self.stale(entry):
+                entry['used'] = time.time()
+                self.save_index()
+                self.memory[url] = data
+                return data, None
+        data, source = self.fetch(url, entry if data is not None else None)
+        if data is not None:
+            self.memory[url] = data
+        return data, source
+
+    def read(self, entry):
+        """ Read a cached JPEG
+
+            Args:
+                entry (dict): The index entry
+
+            Returns:
+                bytes: The JPEG, None if it is not on disk
+        """
+        if not entry:
+            return None
+        try:
+            with open(self.path(entry['digest']), 'rb') as fileh:
+                return fileh.read()
+        except OSError:
+            return None
+
+    def stale(self, entry):
+        """ Determine if an entry should be checked with the source
+
+            Args:
+                entry (dict): The index entry
+
+            Returns:
+                bool: True if the entry should be revalidated
+        """
+        if self.revalidate is None:
+            return False
+        return time.time() - entry.get('validated', 0) > self.revalidate
+
+    def fetch(self, url, entry=None):
+        """ Fetch the artwork for a URL
+
+            Args:
+                url (str): The URL of the source image
+                entry (dict): The current index entry to revalidate
+
+            Returns:
+                tuple: The resized JPEG when the cached one is still current,
+                    or None and the source image
+        """
+        headers = {}
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        response = http_client.get(url, headers=headers)
+        if entry and response.status_code == 304:
+            self.logger.debug("Artwork not modified: %s" % url)
+            with self.lock:
+                entry['validated'] = entry['used'] = time.time()
+                self.save_index()
+                return self.read(entry), None
+        response.raise_for_status()
+        validators = {'etag': response.headers.get('ETag'),
+                      'last_modified': response.headers.get('Last-Modified')}
+        with self.lock:
+            self.sources[url] = response.content, validators
+        return None, response.content
+
+    def store(self, url, data):
+        """ Store the resized artwork for a URL
+
+            Args:
+                url (str): The URL of the source image
+                data (bytes): The resized JPEG
+
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        with self.lock:
+            _source, validators = self.sources.pop(url, (None, {}))
+            self.memory[url] = data
+            if not os.path.exists(self.path(digest)):
+                tmp_path = "%s.tmp" % self.path(digest)
+                with open(tmp_path, 'wb') as fileh:
+                    fileh.write(data)
+                os.replace(tmp_path, self.path(digest))
+            self.index[url] = {'digest': digest,
+                               'etag': validators.get('etag'),
+                               'last_modified': validators.get('last_modified'),
+                               'size': len(data),
+                               'used': time.time(),
+                               'validated': time.time()}
+            self.evict()
+            self.save_index()
+        self.logger.debug("Artwork cached: %s" % url)
+
+    def evict(self):
+        """ Remove the least recently used JPEGs until the cache fits
+        """
+        digests = {}
+        for entry in self.index.values():
+            used, size = digests.get(entry['digest'], (0, entry['size']))
+            digests[entry['digest']] = (max(used, entry['used']), size)
+        total = sum(size for _used, size in digests.values())
+        for digest, (_used, size) in sorted(digests.items(), key=lambda k: k[1][0]):
+            if total <= self.max_bytes:
+                break
+            self.logger.debug("Artwork evicted: %s" % digest)
+            if os.path.exists(self.path(digest)):
+                os.remove(self.path(digest))
+            self.index = {url: entry for url, entry in self.index.items()
+                          if entry['digest'] != digest}
+            total -= size
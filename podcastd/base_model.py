@@ -3,8 +3,19 @@
 import peewee
 import logging
 
+# Write ahead logging lets the API read while an update writes,
+# a busy writer is waited on rather than failing with "database is locked".
+# auto_vacuum only takes effect on a new database, before the journal mode is set
+PRAGMAS = {
+    'auto_vacuum': 'incremental',
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'busy_timeout': 10000,
+    'cache_size': -8000,
+}
+
 # pylint: disable=C0103
-db = peewee.SqliteDatabase('podcastd.db')
+db = peewee.SqliteDatabase('podcastd.db', pragmas=PRAGMAS, timeout=10)
 
 class BaseModel(peewee.Model): # pylint: disable=R0903
     """ The basemodel inherited by all peewee models
@@ -0,0 +1,203 @@
+""" Reuse episodes that have already been downloaded
+
+    Networks push the same enclosure in several feeds and re-publish
+    episodes under new GUIDs. Each downloaded file is indexed by its
+    enclosure URL, its ETag and length and the sha256 of its content. A
+    HEAD request for a new enclosure is checked against the index, a match
+    is satisfied from the local file, a hardlink when the tags would be
+    the same and a copy when they differ.
+"""
+import logging
+import os
+import shutil
+import threading
+from collections import namedtuple
+
+import requests
+
+from . import http_client
+
+# pylint: disable=C0103
+Source = namedtuple('Source', 'file_name url etag length content_hash tags')
+
+def episode_tags(episode):
+    """ The values an episode's file is tagged with
+
+        Args:
+            episode (Episode): The episode, with its podcast loaded
+
+        Returns:
+            tuple: The author, title, album and image URL
+    """
+    return (episode.author, episode.title, episode.podcast.name,
+            episode.podcast.image or episode.image)
+
+def head(url, timeout):
+    """ Find the final URL, ETag and length of an enclosure
+
+        Args:
+            url (str): The enclosure URL
+            timeout (tuple): The connect and read timeouts
+
+        Returns:
+            tuple: The final URL, the ETag and the length, None if the server did not say
+    """
+    response = http_client.head(url, allow_redirects=True, timeout=timeout,
+                                headers={'Accept-Encoding': 'identity'})
+    response.raise_for_status()
+    length = response.headers.get('Content-Length', '')
+    return response.url, response.headers.get('ETag'), int(length) if length.isdigit() else None
+
+def link_or_copy(source, fname, link):
+    """ Place a copy of a file, through a .part file like a download
+
+        Args:
+            source (str): The existing file
+            fname (str): The file name
+            link (bool): True to hardlink when the filesystem allows it
+
+        Returns:
+            str: 'link' or 'copy'
+    """
+    part = "%s.part" % fname
+    if os.path.exists(part):
+        os.remove(part)
+    if link:
+        try:
+            os.link(source, part)
+            os.replace(part, fname)
+            return 'link'
+        except OSError:
+            pass
+    shutil.copyfile(source, part)
+    os.replace(part, fname)
+    return 'copy'
+
+class DedupeIndex:
+    """ The downloaded episodes by enclosure URL, ETag and length and content hash
+
+        The index is loaded on the updater's thread and read and extended
+        from the download workers, it does not touch the database.
+    """
+    def __init__(self, logger=None):
+        """ Init the index
+        """
+        self.logger = logger or logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.by_url = {}
+        self.by_etag = {}
+        self.by_hash = {}
+
+    @classmethod
+    def load(cls, logger=None):
+        """ Index the downloaded episodes
+
+            Returns:
+                DedupeIndex: The index
+        """
+        from .episode import Episode
+        from .podcast import Podcast
+        index = cls(logger=logger)
+        query = (Episode.select(Episode, Podcast)
+                 .join(Podcast)
+                 .where(Episode.status == 'downloaded', Episode.file_name.is_null(False)))
+        for episode in query:
+            index.add(episode.dedupe_source())
+        return index
+
+    def __len__(self):
+        return len(self.by_url)
+
+    def add(self, source):
+        """ Add a downloaded file
+
+            Args:
+                source (Source): The file
+
+        """
+        with self.lock:
+            self.by_url[source.url] = source
+            if source.etag and source.length:
+                self.by_etag[(source.etag, source.length)] = source
+            if source.content_hash:
+                self.by_hash[source.content_hash] = source
+
+    def find(self, url=None, etag=None, length=None, content_hash=None):
+        """ Find a file with the same content that is still on disk
+
+            A file with the same URL only matches when its ETag and length
+            are unchanged.
+
+            Args:
+                url (str): The enclosure URL
+                etag (str): The enclosure's ETag
+                length (int): The enclosure's length
+                content_hash (str): The sha256 of the content
+
+            Returns:
+                Source: The file, None if there is no match
+        """
+        with self.lock:
+            candidates = [self.by_hash.get(content_hash)]
+            if etag and length:
+                candidates.append(self.by_etag.get((etag, length)))
+            source = self.by_url.get(url)
+            if (source and length and source.length == length
+                    and (not source.etag or not etag or source.etag == etag)):
+                candidates.append(source)
+        for source in candidates:
+            if source and os.path.exists(source.file_name):
+                return source
+        return None
+
+    def reuse(self, url, fname, tags, timeout):
+        """ Satisfy a download from a matching file without fetching it
+
+            Args:
+                url (str): The enclosure URL
+                fname (str): The file name
+                tags (tuple): The values the file will be tagged with
+                timeout (tuple): The connect and read timeouts
+
+            Returns:
+                dict: The download statistics, None if the enclosure must be downloaded
+        """
+        if not self.by_url:
+            return None
+        try:
+            final_url, etag, length = head(url, timeout)
+        except requests.exceptions.RequestException as err:
+            self.logger.debug("HEAD failed (%s): %s" % (err, url))
+            return None
+        source = self.find(url, etag, length) or self.find(final_url, etag, length)
+        if source is None or source.file_name == fname:
+            return None
+        try:
+            method = link_or_copy(source.file_name, fname, link=source.tags == tags)
+        except FileNotFoundError:
+            return None
+        self.logger.info("Reused %s (%s): %s" % (source.file_name, method, fname))
+        return {'bytes': 0, 'reused': method, 'content_hash': source.content_hash,
+                'etag': etag, 'length': length or source.length}
+
+    def link_duplicate(self, fname, stats, tags):
+        """ Replace a downloaded file with a hardlink to an identical file with the same tags
+
+            Args:
+                fname (str): The file name
+                stats (dict): The download statistics
+                tags (tuple): The values the file will be tagged with
+
+            Returns:
+                bool: True if the file was replaced
+        """
+        source = self.find(content_hash=stats['content_hash'])
+        if source is None or source.file_name == fname or source.tags != tags:
+            return False
+        try:
+            if link_or_copy(source.file_name, fname, link=True) != 'link':
+                return False
+        except FileNotFoundError:
+            return False
+        self.logger.info("Linked duplicate of %s: %s" % (source.file_name, fname))
+        return True
@@ -0,0 +1,145 @@
+""" Resumable file downloads
+"""
+import hashlib
+import logging
+import os
+import time
+
+import requests
+
+from .http_client import session
+
+CHUNK_SIZE = 64 * 1024
+DEFAULT_TIMEOUT = (10, 60)
+DEFAULT_ATTEMPTS = 3
+# The least seconds between calls to a download's progress callback
+PROGRESS_INTERVAL = 1.0
+
+# pylint: disable=C0103
+logger = logging.getLogger(__name__)
+
+class DownloadError(Exception):
+    """ Raised when a download does not match its Content-Length
+    """
+
+def expected_length(response, offset):
+    """ Determine the full size of a file from a response
+
+        Args:
+            response (Response): The response
+            offset (int): The offset requested with a Range header
+
+        Returns:
+            int: The size of the file, None if the server did not say
+    """
+    if response.status_code == 206:
+        content_range = response.headers.get('Content-Range', '')
+        total = content_range.rpartition('/')[2]
+        return int(total) if total.isdigit() else None
+    length = response.headers.get('Content-Length')
+    if length and length.isdigit():
+        return int(length)
+    return None
+
+def hash_file(fname, hasher):
+    """ Feed the contents of a file to a hash
+
+        Args:
+            fname (str): The file name
+            hasher (hash): The hash to update
+
+        Returns:
+            hash: The hash
+    """
+    with open(fname, 'rb') as fileh:
+        for chunk in iter(lambda: fileh.read(CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher
+
+def download_file(url, fname, timeout=DEFAULT_TIMEOUT, attempts=DEFAULT_ATTEMPTS, progress=None):
+    """ Download a url to a file
+
+        The data is written to a .part file beside fname, an existing
+        .part file is resumed with a Range request. The .part file is
+        renamed to fname once its size matches the Content-Length.
+        The content is hashed as it is written, a resumed download
+        hashes the existing .part file first.
+        The file is requested without a content encoding, one that is
+        encoded regardless is downloaded whole and its length is not checked.
+
+        Args:
+            url (str): The url
+            fname (str): The file name
+            timeout (tuple): The connect and read timeouts
+            attempts (int): The number of times to try
+            progress (callable): Called with the bytes on disk and the expected
+                length, None if unknown, at most every PROGRESS_INTERVAL seconds
+                and once the file is complete
+
+        Returns:
+            dict: The bytes transferred, seconds taken and bytes per second, along
+                with the sha256 of the content, its ETag and its length
+    """
+    part = "%s.part" % fname
+    transferred = 0
+    start = time.monotonic()
+    reported = start
+    for attempt in range(1, attempts + 1):
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        # The session asks for gzip, an encoded body's length does not
+        # match the Content-Length and it can not be resumed with a Range
+        headers = {'Accept-Encoding': 'identity'}
+        if offset:
+            headers['Range'] = 'bytes=%s-' % offset
+        try:
+            with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+                if response.status_code == 416:
+                    logger.debug("Range not satisfiable, restarting: %s" % fname)
+                    os.remove(part)
+                    continue
+                response.raise_for_status()
+                encoded = response.headers.get('Content-Encoding', 'identity') != 'identity'
+                if response.status_code != 206 or encoded:
+                    offset = 0
+                elif offset:
+                    logger.debug("Resuming at %s bytes: %s" % (offset, fname))
+                length = None if encoded else expected_length(response, offset)
+                etag = response.headers.get('ETag')
+                hasher = hash_file(part, hashlib.sha256()) if offset else hashlib.sha256()
+                with open(part, 'ab' if offset else 'wb') as fileh:
+                    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                        fileh.write(chunk)
+                        hasher.update(chunk)
+                        transferred += len(chunk)
+                        if progress is not None and time.monotonic() - reported >= PROGRESS_INTERVAL:
+                            reported = time.monotonic()
+                            progress(fileh.tell(), length)
+        except requests.exceptions.RequestException as err:
+            if attempt == attempts:
+                raise
+            logger.warning("Download interrupted (%s), retrying: %s" % (err, fname))
+            continue
+        size = os.path.getsize(part)
+        if length is not None and size != length:
+            if size > length:
+                os.remove(part)
+            if attempt == attempts:
+                raise DownloadError("%s: expected %s bytes, have %s" % (fname, length, size))
+            logger.warning("Download incomplete (%s of %s bytes), retrying: %s" % (size, length, fname))
+            continue
+        os.replace(part, fname)
+        if progress is not None:
+            progress(size, size)
+        break
+    else:
+        raise DownloadError("%s: gave up after %s attempts" % (fname, attempts))
+    seconds = time.monotonic() - start
+    stats = {'bytes': transferred,
+             'seconds': seconds,
+             'rate': transferred / seconds if seconds else 0,
+             'content_hash': hasher.hexdigest(),
+             'etag': etag,
+             'length': size}
+    logger.info("Downloaded: %s (%s bytes in %.1fs, %.1f KB/s)"
+                % (fname, transferred, seconds, stats['rate'] / 1024))
+    return stats
@@ -1,124 +1,181 @@
 """ The Episode class
 """
 import os
-import shutil
 from datetime import datetime
-from io import BytesIO
 
-import requests
-import eyed3
-from eyed3 import id3
-from PIL import Image
+import pytz
 import logging
-import peewee
-from  peewee import TextField, ForeignKeyField, DateTimeField
+from  peewee import TextField, ForeignKeyField, DateTimeField, IntegerField
 from podcastd.utils import get_valid_filename
+from .download import DEFAULT_TIMEOUT, download_file
+from . import events, http_client, metrics, tagging
 from .base_model import BaseModel
+from .dedupe import Source, episode_tags
 from .podcast import Podcast
+from .revision import Revision
+from .stages import TagJob
 
 
 class Episode(BaseModel):
     """ The Episode class
     """
     author = TextField()
+    content_hash = TextField(null=True)
+    description = TextField(null=True)
     downloaded = DateTimeField(null=True)
+    enclosure_etag = TextField(null=True)
+    enclosure_length = IntegerField(null=True)
     episode_id = TextField(unique=True)
     file_name = TextField(null=True)
     image = TextField(null=True)
     link = TextField()
     podcast = ForeignKeyField(Podcast, backref='podcasts')
     published = DateTimeField()
-    status = TextField(null=True)
+    status = TextField(null=True, index=True)
     title = TextField()
 
+    class Meta: # pylint: disable=C1001, W0232, R0903
+        """ http://docs.peewee-orm.com/en/latest/peewee/models.html#model-options
+        """
+        indexes = (
+            (('podcast', 'published'), False),
+        )
+
     def __init__(self, logger=None, *args, **kwargs):
-        """ Init the class, disalbe the invalid tag warnings
+        """ Init the class
         """
         super(Episode, self).__init__(self, *args, **kwargs)
         self.logger = logger or logging.getLogger(__name__)
-        self.valid_id3s = [id3.ID3_V1, id3.ID3_V1_0, id3.ID3_V1_1, id3.ID3_V2_3, id3.ID3_V2_4]
-        peewee.Model.__init__(self, *args, **kwargs)
 
-    def download(self, base_dir):
-        """ Download an episode
+    def save(self, *args, **kwargs):
+        """ Save the episode and record the change
+        """
+        result = super(Episode, self).save(*args, **kwargs)
+        Revision.bump('episodes')
+        return result
+
+    def file_path(self, base_dir):
+        """ Build the file name for an episode
 
             Args:
                 base_dir: The base directory in which files should be placed
 
+            Returns:
+                str: The file name
         """
         podcast = get_valid_filename(self.podcast.name)
-        title = f"{self.title.strip()} {self.published}.mp3"
+        title = f"{self.title.strip()} {pytz.utc.localize(self.published)}.mp3"
         title = get_valid_filename(title)
-        fname = os.path.join(base_dir, podcast, title)
+        return os.path.join(base_dir, podcast, title)
+
+    def fetch(self, fname, timeout=DEFAULT_TIMEOUT, dedupe=None):
+        """ Retrieve the episode's audio, without touching the database
+
+            Args:
+                fname (str): The file name
+                timeout (tuple): The connect and read timeouts
+                dedupe (DedupeIndex): The files already downloaded, an enclosure
+                    found there is copied instead of downloaded
+
+            Returns:
+                dict: The download statistics
+        """
+        if dedupe is not None:
+            with metrics.PHASE_SECONDS.time(phase='reuse'):
+                stats = dedupe.reuse(self.link, fname, episode_tags(self), timeout)
+            if stats:
+                return stats
         self.logger.info("Downloading: %s" % fname)
-        response = requests.get(self.link, stream=True)
-        with open(fname, 'wb') as fileh:
-            shutil.copyfileobj(response.raw, fileh)
+        stats = download_file(self.link, fname, timeout=timeout, progress=self.progress)
+        metrics.PHASE_SECONDS.observe(stats['seconds'], phase='download')
+        metrics.DOWNLOAD_BYTES.observe(stats['bytes'])
+        metrics.DOWNLOAD_RATE.observe(stats['rate'])
+        if dedupe is not None and dedupe.link_duplicate(fname, stats, episode_tags(self)):
+            stats['reused'] = 'link'
+        return stats
+
+    def progress(self, received, length):
+        """ Publish the progress of the episode's download
+
+            Args:
+                received (int): The bytes on disk
+                length (int): The expected length, None if unknown
+
+        """
+        events.publish('download_progress', episode=self.id, podcast=self.podcast_id,
+                       received=received, length=length)
+
+    def dedupe_source(self):
+        """ Describe the downloaded file for the dedupe index
+
+            Returns:
+                Source: The file
+        """
+        return Source(self.file_name, self.link, self.enclosure_etag, self.enclosure_length,
+                      self.content_hash, episode_tags(self))
+
+    def finish_download(self, fname, stats=None):
+        """ Record a completed download
+
+            Args:
+                fname (str): The file name
+                stats (dict): The download statistics
+
+        """
+        if stats:
+            self.content_hash = stats.get('content_hash')
+            self.enclosure_etag = stats.get('etag')
+            self.enclosure_length = stats.get('length')
         self.file_name = fname
         self.status = 'downloaded'
         self.downloaded = datetime.now()
         self.save()
-        self.tag_file()
 
-    def clear_tags(self):
-        """ Clear the id3 tags from a file
-        """
-        current_tag = id3.Tag()
-        for entry in self.valid_id3s:
-            current_tag.parse(self.file_name, version=entry)
-            current_tag.clear()
-            current_tag.save(filename=self.file_name, version=entry)
-
-    def tag_file(self):
-        """ Add the tags to a file
+    def tag_job(self, fname, artwork=None):
+        """ Build the tags for a file
             Set genre to 255 for compatibility with BMW iDrive
 
+            The artwork is taken from the image URL in the DB, then from
+            the information in the podcast RSS. Without either the job
+            leaves the image to be read from the existing id3 tags. An
+            image not in the cache is left for the tag stage to resize.
+
+            Args:
+                fname (str): The file name
+                artwork (ArtworkCache): The cache for images from a URL
+
+            Returns:
+                TagJob: The job for the tag stage
         """
-        new_tag = id3.Tag()
-        image = self.get_image()
-        new_tag.artist = self.author
-        new_tag.album_artist = self.author
-        new_tag.title = self.title
-        new_tag.album = self.podcast.name
-        genre = id3.Genre(id=255, name=u"Podcast")
-        new_tag.genre = genre
-        if image:
-            new_tag.images.set(3, image, 'image/jpeg', '')
-        self.clear_tags()
-        new_tag.save(filename=self.file_name, version=id3.ID3_V2_3)
-
-    def get_image(self):
-        """ Get an image for the file
-            1) From the image URL in the DB
-            2) From the information in the podcast RSS
-            3) From the existing id3 tags
+        frames = (tagging.text_frame('TPE1', self.author),
+                  tagging.text_frame('TPE2', self.author),
+                  tagging.text_frame('TIT2', self.title),
+                  tagging.text_frame('TALB', self.podcast.name),
+                  tagging.text_frame('TCON', '(255)Podcast'))
+        image = source = None
+        url = self.podcast.image or self.image
+        if url:
+            with metrics.PHASE_SECONDS.time(phase='image'):
+                if artwork:
+                    image, source = artwork.get(url)
+                else:
+                    source = http_client.get(url).content
+        return TagJob(fname, frames, image, source)
+
+    def tagged(self, job, result):
+        """ Record the outcome of a tag job
+
+            Args:
+                job (TagJob): The job
+                result (dict): The result of the job
+
         """
-        image = None
-        if self.podcast.image:
-            response = requests.get(self.podcast.image)
-            image = Image.open(BytesIO(response.content))
-        if not image and self.image:
-            response = requests.get(self.image)
-            image = Image.open(BytesIO(response.content))
-        if not image:
-            current_tag = id3.Tag()
-            for entry in self.valid_id3s:
-                current_tag.parse(self.file_name, version=entry)
-                if not image and current_tag.images:
-                    image = Image.open(BytesIO(current_tag.images[0].image_data))
-                    break
-        if not image:
-            image = Image.open(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'record.png'))
-            self.logger.warning("Using default image: %s" % self.file_name)
-
-        if image:
-            size = 400, 400
-            image.thumbnail(size, Image.ANTIALIAS)
-            image = image.convert('RGB')
-            bytes_io = BytesIO()
-            image.save(bytes_io, "JPEG")
-            return bytes_io.getvalue()
-        return None
+        if job.image is None:
+            metrics.PHASE_SECONDS.observe(result['image_seconds'], phase='image')
+        metrics.PHASE_SECONDS.observe(result['tag_seconds'], phase='tag')
+        if result['default_image']:
+            self.logger.warning("Using default image: %s" % job.file_name)
+        self.logger.debug("Tagged: %s (%s bytes written)" % (job.file_name, result['written']))
 
     def delete(self):
         """ Delete a file
@@ -128,3 +185,5 @@ class Episode(BaseModel):
             self.status = 'removed'
             self.save()
             self.logger.debug("Removed: %s" % self.file_name)
+            events.publish('episode_removed', episode=self.id, podcast=self.podcast_id,
+                           file_name=self.file_name)
@@ -0,0 +1,171 @@
+""" In-process publish and subscribe for the changes an update makes
+
+    Events are numbered as they are published and the most recent are kept
+    in a backlog, a subscriber that reconnects with the id of the last
+    event it saw is sent the events it missed. Each subscriber has a
+    bounded buffer, a subscriber that falls too far behind is closed
+    rather than slowing the publisher, it can reconnect and resume from
+    the backlog. When the events it missed are no longer in the backlog,
+    or the ids have restarted, it is sent a reset event and should fetch
+    the current state.
+"""
+import json
+import threading
+import time
+from collections import deque, namedtuple
+
+BACKLOG = 1000
+BUFFER = 256
+# The most seconds a stream goes without sending something, so proxies keep it open
+KEEPALIVE = 15
+
+# pylint: disable=C0103
+Event = namedtuple('Event', 'id kind data time')
+
+def to_sse(event):
+    """ Format an event for a text/event-stream response
+
+        Args:
+            event (Event): The event
+
+        Returns:
+            str: The event
+    """
+    data = dict(event.data, time=event.time)
+    return "id: %s\nevent: %s\ndata: %s\n\n" % (event.id, event.kind, json.dumps(data))
+
+class Subscriber:
+    """ A subscriber's buffer of events
+    """
+    def __init__(self, kinds=None, size=BUFFER):
+        """ Init the subscriber
+
+            Args:
+                kinds (set): The kinds of event wanted, None for all
+                size (int): The most events to buffer
+
+        """
+        self.kinds = kinds
+        self.size = size
+        self.events = deque()
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def put(self, event):
+        """ Buffer an event, closing the subscriber when the buffer is full
+
+            Args:
+                event (Event): The event
+
+        """
+        if self.kinds is not None and event.kind not in self.kinds and event.kind != 'reset':
+            return
+        with self.condition:
+            if self.closed:
+                return
+            if len(self.events) >= self.size:
+                self.closed = True
+            else:
+                self.events.append(event)
+            self.condition.notify()
+
+    def get(self, timeout=None):
+        """ Wait for the next event
+
+            Args:
+                timeout (float): The seconds to wait
+
+            Returns:
+                Event: The event, None if there was none in time or the subscriber is closed
+        """
+        with self.condition:
+            if not self.events and not self.closed:
+                self.condition.wait(timeout)
+            if self.events:
+                return self.events.popleft()
+            return None
+
+class EventBus:
+    """ Publish events to the current subscribers and keep a backlog
+    """
+    def __init__(self, backlog=BACKLOG):
+        """ Init the bus
+
+            Args:
+                backlog (int): The number of recent events to keep
+
+        """
+        self.lock = threading.Lock()
+        self.backlog = deque(maxlen=backlog)
+        self.subscribers = set()
+        self.last_id = 0
+
+    def publish(self, kind, **data):
+        """ Publish an event
+
+            Args:
+                kind (str): The kind of event
+                data (dict): The details, they must serialize as JSON
+
+            Returns:
+                Event: The event
+        """
+        with self.lock:
+            self.last_id += 1
+            event = Event(self.last_id, kind, data, round(time.time(), 3))
+            self.backlog.append(event)
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.put(event)
+        return event
+
+    def subscribe(self, last_id=None, kinds=None, size=BUFFER):
+        """ Subscribe to the events
+
+            Args:
+                last_id (int): The id of the last event seen, the events since
+                    are replayed from the backlog. None for only new events.
+                kinds (set): The kinds of event wanted, None for all
+                size (int): The most events to buffer
+
+            Returns:
+                Subscriber: The subscriber
+        """
+        with self.lock:
+            replay = []
+            if last_id is not None:
+                oldest = self.backlog[0].id if self.backlog else self.last_id + 1
+                if last_id > self.last_id or last_id < oldest - 1:
+                    replay = [Event(self.last_id, 'reset', {}, round(time.time(), 3))]
+                else:
+                    replay = [x for x in self.backlog if x.id > last_id]
+            # The replayed events do not count against the buffer
+            subscriber = Subscriber(kinds=kinds, size=size + len(replay))
+            for event in replay:
+                subscriber.put(event)
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        """ Stop sending events to a subscriber
+
+            Args:
+                subscriber (Subscriber): The subscriber
+
+        """
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+bus = EventBus()
+
+def publish(kind, **data):
+    """ Publish an event on the process's bus
+
+        Args:
+            kind (str): The kind of event
+            data (dict): The details
+
+        Returns:
+            Event: The event
+    """
+    return bus.publish(kind, **data)
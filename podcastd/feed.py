@@ -0,0 +1,180 @@
+""" Incremental RSS parsing
+
+    Podcast feeds list their newest episodes first, so for a feed we have
+    seen before only the first few entries matter. The entries are read one
+    at a time and parsing stops at the first entry that is already known or
+    older than the podcast's max_age. Anything that isn't a well formed,
+    newest first RSS feed is handed to feedparser, which is only imported
+    when it is needed.
+"""
+import logging
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+from .utils import to_utc
+
+CHUNK_SIZE = 64 * 1024
+ITUNES = '{http://www.itunes.com/dtds/podcast-1.0.dtd}'
+DC = '{http://purl.org/dc/elements/1.1/}'
+
+# pylint: disable=C0103
+logger = logging.getLogger(__name__)
+
+class FeedDict(dict):
+    """ A dict whose keys can also be read as attributes, like feedparser's
+    """
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+class Unordered(Exception):
+    """ Raised when a feed is not listed newest first
+    """
+
+def child_text(elem, *tags):
+    """ Return the text of the first child element found
+
+        Args:
+            elem (Element): The parent element
+            tags (str): The tags to look for, in order of preference
+
+        Returns:
+            str: The text, None if no child was found
+    """
+    for tag in tags:
+        child = elem.find(tag)
+        if child is not None and child.text:
+            return child.text.strip()
+    return None
+
+def parse_item(item):
+    """ Convert an RSS item to a feedparser style entry
+
+        Args:
+            item (Element): The item
+
+        Returns:
+            FeedDict: The entry
+    """
+    entry = FeedDict()
+    entry['title'] = child_text(item, 'title') or ''
+    entry['id'] = child_text(item, 'guid', 'link')
+    published = child_text(item, 'pubDate', DC + 'date')
+    if published:
+        entry['published'] = published
+    author = child_text(item, ITUNES + 'author', 'author', DC + 'creator')
+    if author:
+        entry['author'] = author
+    summary = child_text(item, 'description', ITUNES + 'summary')
+    if summary:
+        entry['summary'] = summary
+    image = item.find(ITUNES + 'image')
+    if image is not None and image.get('href'):
+        entry['image'] = FeedDict(href=image.get('href'))
+    entry['links'] = [FeedDict(rel='enclosure', href=x.get('url'), type=x.get('type'))
+                      for x in item.findall('enclosure')]
+    return entry
+
+def published_time(entry):
+    """ Return the publication time of an entry
+
+        Args:
+            entry (FeedDict): The entry
+
+        Returns:
+            datetime: The time in UTC, None if it is missing or unparsable
+    """
+    try:
+        return to_utc(entry['published'])
+    except (KeyError, ValueError, OverflowError):
+        return None
+
+def stream_entries(data, known_ids, earliest):
+    """ Parse an RSS feed, stopping at the first known or expired entry
+
+        Args:
+            data (bytes): The feed
+            known_ids (set): Ids of episodes already stored
+            earliest (datetime): Entries published before this are expired
+
+        Returns:
+            tuple: The feed, the number of bytes parsed and whether parsing stopped early
+    """
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    feed_image = None
+    entries = []
+    depth = 0
+    previous = None
+    stop_at = None
+    for offset in range(0, len(data), CHUNK_SIZE):
+        parser.feed(data[offset:offset + CHUNK_SIZE])
+        for event, elem in parser.read_events():
+            if event == 'start':
+                if depth == 0 and elem.tag != 'rss':
+                    raise Unordered("Not an RSS feed: %s" % elem.tag)
+                depth += 1
+                continue
+            depth -= 1
+            if elem.tag == ITUNES + 'image' and depth == 2 and not feed_image:
+                feed_image = elem.get('href')
+            elif elem.tag == 'image' and depth == 2:
+                feed_image = child_text(elem, 'url') or feed_image
+            elif elem.tag == 'item':
+                entry = parse_item(elem)
+                elem.clear()
+                published = published_time(entry)
+                if published is not None:
+                    if previous is not None and published > previous:
+                        raise Unordered("Entries are not newest first")
+                    previous = published
+                if stop_at is not None:
+                    # One more entry was read to confirm the feed is newest first
+                    return stop_at, min(offset + CHUNK_SIZE, len(data)), True
+                entries.append(entry)
+                expired = published is not None and earliest is not None and published < earliest
+                if entry['id'] in known_ids or expired:
+                    stop_at = FeedDict(feed=FeedDict(image=FeedDict(href=feed_image)),
+                                             entries=list(entries))
+    parser.close()
+    if stop_at is not None:
+        return stop_at, len(data), True
+    feed = FeedDict(feed=FeedDict(image=FeedDict(href=feed_image)), entries=entries)
+    return feed, len(data), False
+
+def parse(data, response_headers=None, known_ids=None, earliest=None):
+    """ Parse a feed, incrementally when possible
+
+        Args:
+            data (bytes): The feed
+            response_headers (dict): The HTTP response headers, for feedparser
+            known_ids (set): Ids of episodes already stored, None to parse in full
+            earliest (datetime): Entries published before this are expired
+
+        Returns:
+            tuple: The feedparser style feed and a dict of parse statistics
+    """
+    profiling = tracemalloc.is_tracing()
+    if profiling:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    stats = {'mode': 'full', 'bytes': len(data), 'stopped_early': False}
+    feed = None
+    if known_ids is not None:
+        try:
+            feed, stats['bytes'], stats['stopped_early'] = stream_entries(data, known_ids, earliest)
+            stats['mode'] = 'stream'
+        except (ET.ParseError, Unordered) as err:
+            logger.debug("Falling back to a full parse: %s" % err)
+    if feed is None:
+        # feedparser is slow to import and most feeds never need it
+        import feedparser
+        feed = feedparser.parse(data, response_headers=response_headers)
+    stats['entries'] = len(feed['entries'])
+    stats['seconds'] = time.perf_counter() - start
+    if profiling:
+        stats['peak_bytes'] = tracemalloc.get_traced_memory()[1] - baseline
+    return feed, stats
@@ -0,0 +1,151 @@
+""" The shared HTTP client
+
+    Feeds, artwork, enclosures and the Slack webhook are all fetched
+    through one session, so a show whose feed, artwork and enclosures are
+    on the same CDN reuses its connections. Every request has a connect
+    and read timeout. Idempotent requests are retried with a backoff on
+    connection errors and on the statuses a busy server answers with.
+"""
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+DEFAULT_TIMEOUT = (10, 30)
+POOL_HOSTS = 32
+POOL_SIZE = 8
+RETRIES = 2
+BACKOFF_FACTOR = 0.5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+class ConnectionCounts:
+    """ Counts of the requests made and the connections opened for them
+    """
+    def __init__(self):
+        """ Init the counts
+        """
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.opened = 0
+
+    def add(self, key):
+        """ Add to a count
+
+            Args:
+                key (str): 'requests' or 'opened'
+
+        """
+        with self.lock:
+            setattr(self, key, getattr(self, key) + 1)
+
+    def snapshot(self):
+        """ The counts so far
+
+            Returns:
+                dict: The requests made and the connections opened and reused
+        """
+        with self.lock:
+            return {'requests': self.requests, 'opened': self.opened,
+                    'reused': self.requests - self.opened}
+
+# pylint: disable=C0103
+counts = ConnectionCounts()
+
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    """ A connection pool that counts its requests and new connections
+    """
+    def _new_conn(self):
+        counts.add('opened')
+        return super()._new_conn()
+
+    def urlopen(self, *args, **kwargs): # pylint: disable=W0221
+        counts.add('requests')
+        return super().urlopen(*args, **kwargs)
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    """ A TLS connection pool that counts its requests and new connections
+    """
+    def _new_conn(self):
+        counts.add('opened')
+        return super()._new_conn()
+
+    def urlopen(self, *args, **kwargs): # pylint: disable=W0221
+        counts.add('requests')
+        return super().urlopen(*args, **kwargs)
+
+class Adapter(HTTPAdapter):
+    """ An adapter with a pool for each host that counts its connections
+    """
+    def init_poolmanager(self, *args, **kwargs): # pylint: disable=W0221
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': CountingHTTPConnectionPool,
+                                                   'https': CountingHTTPSConnectionPool}
+
+def build_session():
+    """ Build a session with pooled connections and retries
+
+        Returns:
+            Session: The session
+    """
+    retry = Retry(total=RETRIES, backoff_factor=BACKOFF_FACTOR, status_forcelist=RETRY_STATUSES,
+                  allowed_methods=('GET', 'HEAD'), raise_on_status=False)
+    adapter = Adapter(pool_connections=POOL_HOSTS, pool_maxsize=POOL_SIZE, max_retries=retry)
+    new_session = requests.Session()
+    new_session.mount('http://', adapter)
+    new_session.mount('https://', adapter)
+    new_session.headers['Accept-Encoding'] = 'gzip, deflate'
+    return new_session
+
+session = build_session()
+
+def request(method, url, timeout=DEFAULT_TIMEOUT, **kwargs):
+    """ Make a request through the shared session
+
+        Args:
+            method (str): The method
+            url (str): The URL
+            timeout (tuple): The connect and read timeouts
+            kwargs (dict): Passed on to the session
+
+        Returns:
+            Response: The response
+    """
+    return session.request(method, url, timeout=timeout, **kwargs)
+
+def get(url, **kwargs):
+    """ Make a GET request, retried on failure
+
+        Args:
+            url (str): The URL
+            kwargs (dict): Passed on to the session
+
+        Returns:
+            Response: The response
+    """
+    return request('GET', url, **kwargs)
+
+def head(url, **kwargs):
+    """ Make a HEAD request, retried on failure
+
+        Args:
+            url (str): The URL
+            kwargs (dict): Passed on to the session
+
+        Returns:
+            Response: The response
+    """
+    return request('HEAD', url, **kwargs)
+
+def post(url, **kwargs):
+    """ Make a POST request, never retried
+
+        Args:
+            url (str): The URL
+            kwargs (dict): Passed on to the session
+
+        Returns:
+            Response: The response
+    """
+    return request('POST', url, **kwargs)
@@ -1,13 +1,17 @@
 """Logger"""
 
+import atexit
 import errno
 import os
-import copy
 import logging
+import queue
 from logging import getLogger
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
 from . import constants as C
 
+# pylint: disable=C0103
+listener = None
+
 class SimpleFormatter(logging.Formatter):
     """ A simple class to format log output
     """
@@ -37,7 +41,7 @@ class ColorFormatter(logging.Formatter):
     COLORS['NAME'] = "\033[%sm" % (";".join(C.FAINT))
 
     def __init__(self, app_name, use_color=True):
-        self.FORMAT = ("[$NAME%(app_name)-10s$RESET][$NAME%(name)-30s$RESET][%(levelname)19s] "
+        self.FORMAT = ("[$NAME%(app_name)-10s$RESET][$NAME%(name)-30s$RESET][%(levelname_color)19s] "
                        "%(message)s "
                        "(%(filename)s:%(lineno)d)")
         self.app_name = app_name
@@ -53,12 +57,31 @@ class ColorFormatter(logging.Formatter):
         return msg
 
     def format(self, record):
-        colored_record = copy.copy(record)
-        colored_record.app_name = self.app_name
-        levelname = colored_record.levelname
-        levelname_color = self.COLORS[levelname] + levelname + C.RESET_SEQ
-        colored_record.levelname = levelname_color
-        return logging.Formatter.format(self, colored_record)
+        record.app_name = self.app_name
+        record.levelname_color = self.COLORS[record.levelname] + record.levelname + C.RESET_SEQ
+        return logging.Formatter.format(self, record)
+
+class EnqueueHandler(QueueHandler):
+    """ Hand records to the listener thread
+
+        The listener runs in the same process, so the record is passed on
+        as is rather than copied and formatted. Only the message is merged
+        with its arguments, which may change once the call returns.
+    """
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+def stop_listener():
+    """ Write out the queued records and stop the listener thread
+    """
+    global listener # pylint: disable=W0603
+    if listener:
+        listener.stop()
+        listener = None
+
+atexit.register(stop_listener)
 
 def mkdir_p(path):
     """ Make a directory if it deosn't exists
@@ -87,54 +110,75 @@ class Logger:
     def add_loggers(self, flask_app=None):
         """ Add the default, module and app loggers
 
+            Every logger hands its records to a queue, a single listener
+            thread formats them and writes them to the console and log file.
+
             Args:
                 flask_app (App): A flask app
 
             Returns:
                 App: A flask app
         """
+        global listener # pylint: disable=W0603
+        stop_listener()
+        handlers = [self.console_handler(), self.file_handler()]
+        records = queue.SimpleQueue()
+        listener = QueueListener(records, *handlers, respect_handler_level=True)
+        listener.start()
+        # Records below every handler's level are dropped before they are queued
+        floor = min(x.level for x in handlers)
+
         # Set up the default logger
         logger = logging.getLogger()
-        logger.handlers = []
-        logger.addHandler(self.console_handler())
-        logger.addHandler(self.file_handler())
-        logger.setLevel(self.settings.logging_levels['default'])
+        logger.handlers = [EnqueueHandler(records)]
+        logger.setLevel(self.level(self.settings.logging_levels['default'], floor))
         # Set up each of the module loggers
         for name, log_level in self.settings.logging_levels.items():
             if name == 'app.logger' and flask_app:
-                flask_app = self.flask_app_logger(flask_app=flask_app, log_level=log_level)
-            else:
+                flask_app = self.flask_app_logger(flask_app=flask_app, log_level=self.level(log_level, floor))
+            elif name != 'default':
                 getLogger(name).handlers = []
-                getLogger(name).addHandler(self.console_handler())
-                getLogger(name).addHandler(self.file_handler())
-                getLogger(name).setLevel(log_level)
-                getLogger(name).propagate = False
+                getLogger(name).setLevel(self.level(log_level, floor))
+                getLogger(name).propagate = True
 
         # Set the flask app to default if not specified
         if flask_app and 'app.logger' not in self.settings.logging_levels:
             flask_app = self.flask_app_logger(flask_app=flask_app,
-                                              log_level=self.settings.logging_levels['default'])
+                                              log_level=self.level(self.settings.logging_levels['default'], floor))
 
         if flask_app:
             return flask_app
         return None
 
+    @staticmethod
+    def level(log_level, floor):
+        """ The level for a logger, no lower than the handlers will write
+
+            Args:
+                log_level (str): A log level
+                floor (int): The lowest level of the handlers
+
+            Returns:
+                int: The level
+        """
+        if isinstance(log_level, str):
+            log_level = logging.getLevelName(log_level)
+        return max(log_level, floor)
+
     def flask_app_logger(self, flask_app, log_level):
         """ Set up the flask app logging
 
             Args:
                 flask_app (App): A flask app
-                log_level (str): A log level
+                log_level (int): A log level
 
             Returns:
                 App: The flask app
 
         """
         flask_app.logger.handlers = []
-        flask_app.logger.addHandler(self.console_handler())
-        flask_app.logger.addHandler(self.file_handler())
         flask_app.logger.setLevel(log_level)
-        flask_app.logger.propagate = False
+        flask_app.logger.propagate = True
         return flask_app
 
     def console_handler(self):
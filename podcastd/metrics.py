@@ -0,0 +1,186 @@
+""" Prometheus metrics
+
+    Histograms of where an update spends its time and of the API's request
+    latency, rendered in the Prometheus text format. Nothing is recorded
+    until enable() is called, a disabled histogram returns as soon as it
+    is observed so the instrumentation can stay in place.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+BYTES_BUCKETS = tuple(2 ** x for x in range(10, 32, 2))
+RATE_BUCKETS = tuple(2 ** x for x in range(10, 28, 2))
+
+# pylint: disable=C0103
+enabled = False
+registry = []
+
+def enable(on=True):
+    """ Turn recording on or off
+
+        Args:
+            on (bool): True to record
+
+    """
+    global enabled # pylint: disable=W0603
+    enabled = bool(on)
+
+def escape(value):
+    """ Escape a label value
+
+        Args:
+            value (str): The value
+
+        Returns:
+            str: The escaped value
+    """
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+def format_labels(pairs):
+    """ Format label pairs for the text format
+
+        Args:
+            pairs (list): The label names and values
+
+        Returns:
+            str: The labels in braces, empty without labels
+    """
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, escape(value)) for name, value in pairs)
+
+def format_number(value):
+    """ Format a sample value
+
+        Args:
+            value (float): The value
+
+        Returns:
+            str: The value, without a trailing .0 for integers
+    """
+    if value == float('inf'):
+        return '+Inf'
+    return repr(int(value)) if float(value).is_integer() else repr(float(value))
+
+NOT_TIMING = nullcontext()
+
+class Timer:
+    """ Observe the seconds spent in a with block
+    """
+    def __init__(self, histogram, labels):
+        """ Init the timer
+
+            Args:
+                histogram (Histogram): The histogram to observe
+                labels (dict): A value for each label name
+
+        """
+        self.histogram = histogram
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+class Histogram:
+    """ A histogram with a fixed set of label names
+    """
+    def __init__(self, name, documentation, labels=(), buckets=SECONDS_BUCKETS):
+        """ Init the histogram and add it to the registry
+
+            Args:
+                name (str): The metric name
+                documentation (str): The help text
+                labels (tuple): The label names
+                buckets (tuple): The upper bounds of the buckets, ascending
+
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def observe(self, value, **labels):
+        """ Record a value
+
+            Args:
+                value (float): The value
+                labels (dict): A value for each label name
+
+        """
+        if not enabled:
+            return
+        key = tuple(labels[x] for x in self.labels)
+        idx = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][idx] += 1
+            series[1] += value
+
+    def time(self, **labels):
+        """ Record the seconds spent in a with block
+
+            Args:
+                labels (dict): A value for each label name
+
+            Returns:
+                obj: The context manager
+        """
+        if not enabled:
+            return NOT_TIMING
+        return Timer(self, labels)
+
+    def render(self):
+        """ Render the histogram
+
+            Returns:
+                list: The lines in the text format
+        """
+        lines = ["# HELP %s %s" % (self.name, self.documentation),
+                 "# TYPE %s histogram" % self.name]
+        with self.lock:
+            series = sorted((key, list(counts), total) for key, (counts, total) in self.series.items())
+        for key, counts, total in series:
+            pairs = list(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                lines.append("%s_bucket%s %s" % (self.name, format_labels(pairs + [('le', format_number(bound))]),
+                                                 cumulative))
+            lines.append("%s_sum%s %s" % (self.name, format_labels(pairs), format_number(total)))
+            lines.append("%s_count%s %s" % (self.name, format_labels(pairs), cumulative))
+        return lines
+
+def render():
+    """ Render every metric
+
+        Returns:
+            str: The metrics in the Prometheus text format
+    """
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+PHASE_SECONDS = Histogram('podcastd_phase_seconds',
+                          "Seconds spent in each phase of an update, per podcast or episode",
+                          labels=('phase',))
+DOWNLOAD_BYTES = Histogram('podcastd_download_bytes', "Bytes transferred per episode download",
+                           buckets=BYTES_BUCKETS)
+DOWNLOAD_RATE = Histogram('podcastd_download_bytes_per_second', "Transfer rate of each episode download",
+                          buckets=RATE_BUCKETS)
+REQUEST_SECONDS = Histogram('podcastd_http_request_seconds', "Seconds spent handling each API request",
+                            labels=('method', 'route', 'status'))
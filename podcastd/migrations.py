@@ -0,0 +1,69 @@
+""" Bring an existing database up to date with the models
+"""
+import logging
+
+from playhouse.migrate import SqliteMigrator, migrate
+
+from .episode import Episode
+from .podcast import Podcast
+from .retention import ArchivedEpisode
+from .revision import Revision
+from .search import create_index
+from .utils import to_utc
+
+# pylint: disable=C0103
+logger = logging.getLogger(__name__)
+
+MODELS = [Podcast, Episode, Revision, ArchivedEpisode]
+
+def add_missing_columns(database, model):
+    """ Add any nullable columns a model has that its table does not
+
+        Args:
+            database (Database): The database
+            model (Model): The model
+
+    """
+    migrator = SqliteMigrator(database)
+    table = model._meta.table_name
+    existing = [column.name for column in database.get_columns(table)]
+    operations = []
+    for field in model._meta.sorted_fields:
+        if field.column_name not in existing:
+            logger.info("Adding column: %s.%s" % (table, field.column_name))
+            operations.append(migrator.add_column(table, field.column_name, field))
+    if operations:
+        migrate(*operations)
+
+def normalize_published(database):
+    """ Rewrite episode publication times as naive UTC
+
+        Older databases stored the time with the feed's UTC offset,
+        which SQLite can neither order nor compare correctly.
+
+        Args:
+            database (Database): The database
+
+    """
+    cursor = database.execute_sql("SELECT id, published FROM episode WHERE length(published) != 19")
+    rows = cursor.fetchall()
+    if rows:
+        logger.info("Normalizing publication times: %s episodes" % len(rows))
+    for episode_id, published in rows:
+        query = Episode.update(published=to_utc(published).replace(microsecond=0)).where(Episode.id == episode_id)
+        query.execute()
+
+def migrate_database(database):
+    """ Create any missing tables and migrate the existing ones
+
+        Args:
+            database (Database): The database
+
+    """
+    with database.atomic():
+        database.create_tables([x for x in MODELS if not x.table_exists()])
+        add_missing_columns(database, Podcast)
+        add_missing_columns(database, Episode)
+        normalize_published(database)
+        Episode._schema.create_indexes(safe=True) # pylint: disable=W0212
+        create_index(database)
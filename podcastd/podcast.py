@@ -1,29 +1,56 @@
 """ The Podcast class
 """
 import os
-from datetime import datetime, timedelta
+import hashlib
+import time
+from datetime import timedelta
 import logging
 
-import feedparser
-import pytz
-from dateutil import parser
-from peewee import TextField, IntegerField
+from peewee import TextField, IntegerField, DateTimeField, chunked
+from podcastd import events, http_client, metrics
 from podcastd.base_model import BaseModel
-from podcastd.utils import get_valid_filename
+from podcastd.feed import parse
+from podcastd.revision import Revision
+from podcastd.utils import get_valid_filename, plain_text, to_utc, utc_now
 from pytimeparse.timeparse import timeparse
 
+# Keep each statement below SQLite's default limit of 999 variables
+LOOKUP_BATCH_SIZE = 900
+INSERT_BATCH_SIZE = 90
+# The number of recent episode ids given to the incremental feed parser
+RECENT_IDS_LIMIT = 20
+# The number of recent publication times used to learn a podcast's cadence
+CADENCE_HISTORY = 10
+# Written on every fetch, left out of the collections so polling does not change their ETags
+FETCH_STATE_FIELDS = ('content_hash', 'etag', 'last_modified', 'last_refreshed', 'next_due')
+
 class Podcast(BaseModel):
     """ The Podcast class
     """
     name = TextField(unique=True)
+    content_hash = TextField(null=True)
+    etag = TextField(null=True)
     image = TextField(null=True)
+    last_modified = TextField(null=True)
+    last_refreshed = DateTimeField(null=True)
     max_age = TextField()
     max_episodes = IntegerField()
+    next_due = DateTimeField(null=True)
+    refresh_interval = TextField(null=True)
     url = TextField()
 
     def __init__(self, logger=None, *args, **kwargs):
         super(Podcast, self).__init__(self, *args, **kwargs)
         self.logger = logger or logging.getLogger(__name__)
+        self.validators_changed = False
+        self.parse_stats = None
+
+    def save(self, *args, **kwargs):
+        """ Save the podcast and record the change
+        """
+        result = super(Podcast, self).save(*args, **kwargs)
+        Revision.bump('podcasts', 'episodes')
+        return result
 
     def build_directory(self, base_dir):
         """ Build a directory for the podcasts
@@ -40,86 +67,270 @@ class Podcast(BaseModel):
             self.logger.debug("Built: %s" % dir_name)
             os.makedirs(dir_name)
 
-    def download_feed(self):
-        """ Download an RSS feed
+    def is_due(self, now):
+        """ Determine if the podcast is due a refresh
+
+            Args:
+                now (datetime): The current time in UTC
+
+            Returns:
+                bool: True if the podcast has not been scheduled or its next due time has passed
+        """
+        return self.next_due is None or self.next_due <= now
+
+    def publish_interval(self, limit=CADENCE_HISTORY):
+        """ Learn the usual time between episodes
+
+            Args:
+                limit (int): The number of recent episodes to learn from
+
+            Returns:
+                timedelta: The median gap between episodes, None with fewer than two
         """
         from .episode import Episode
+        query = (Episode.select(Episode.published)
+                 .where(Episode.podcast == self)
+                 .order_by(Episode.published.desc())
+                 .limit(limit))
+        published = [x[0] for x in query.tuples()]
+        gaps = sorted(newer - older for newer, older in zip(published, published[1:]))
+        if not gaps:
+            return None
+        return gaps[len(gaps) // 2]
 
-        added = 0
+    def mark_refreshed(self, next_due=None):
+        """ Record that the feed was just fetched
+
+            Args:
+                next_due (datetime): When the feed should next be fetched, None for the next update
+
+        """
+        self.last_refreshed = utc_now()
+        self.next_due = next_due
+        query = Podcast.update(last_refreshed=self.last_refreshed, next_due=self.next_due)
+        query.where(Podcast.id == self.id).execute()
+
+    def fetch_feed(self, known_ids=None):
+        """ Retrieve and parse the RSS feed, without touching the database
+
+            The ETag and Last-Modified from the previous fetch are sent
+            back, a 304 or an identical body skips parsing.
+
+            Args:
+                known_ids (set): Ids of the newest episodes already stored,
+                    parsing stops when one is reached. None to parse the whole feed.
+
+            Returns:
+                FeedParserDict: The parsed feed, None if it was unchanged
+        """
         self.logger.info("%s: Retrieving" % self.name)
-        feed = feedparser.parse(self.url)
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        with metrics.PHASE_SECONDS.time(phase='feed_fetch'):
+            response = http_client.get(self.url, headers=headers)
+        if response.status_code == 304:
+            self.logger.debug("%s: Not modified" % self.name)
+            return None
+        response.raise_for_status()
+        validators = response.headers.get('ETag'), response.headers.get('Last-Modified')
+        if validators != (self.etag, self.last_modified):
+            self.etag, self.last_modified = validators
+            self.validators_changed = True
+        content_hash = hashlib.sha256(response.content).hexdigest()
+        if content_hash == self.content_hash:
+            self.logger.debug("%s: Content unchanged" % self.name)
+            return None
+        self.content_hash = content_hash
+        self.validators_changed = True
+        response_headers = dict(response.headers)
+        response_headers['content-location'] = response.url
+        earliest = self.earliest() if known_ids is not None else None
+        feed, self.parse_stats = parse(response.content, response_headers=response_headers,
+                                       known_ids=known_ids, earliest=earliest)
+        metrics.PHASE_SECONDS.observe(self.parse_stats['seconds'], phase='feed_parse')
+        self.logger.debug("%s: Parsed %s entries from %s of %s bytes in %.3fs (%s)"
+                          % (self.name, self.parse_stats['entries'], self.parse_stats['bytes'],
+                             len(response.content), self.parse_stats['seconds'], self.parse_stats['mode']))
+        if 'peak_bytes' in self.parse_stats:
+            self.logger.debug("%s: Parse peak memory %s bytes" % (self.name, self.parse_stats['peak_bytes']))
+        return feed
+
+    def ingest_feed(self, feed):
+        """ Add the new episodes from a parsed feed
+
+            Args:
+                feed (FeedParserDict): The parsed feed, None if it was unchanged
+
+            Returns:
+                int: The number of episodes added
+        """
+        from .episode import Episode
+
+        added = 0
+        if feed is None:
+            self.save_validators()
+            return added
+        start = time.perf_counter()
         feed_image = feed.feed.image.href
+        known = self.known_episode_ids([x['id'] for x in feed['entries']])
+        rows = []
         for episode in feed['entries']:
             links = [x for x in episode['links'] if x['type'] == 'audio/mpeg']
-            published = parser.parse(episode['published'])
-            if published.tzinfo is None or published.tzinfo.utcoffset(published) is None:
-                published = pytz.utc.localize(published)
-            if links:
-                exists = Episode.select().where(Episode.episode_id == episode['id'])
-                if not exists:
-                    if 'image' in episode and 'href' in episode['image']['href']:
-                        image = episode['image']['href']
-                        self.logger.debug("%s/%s: Using episode image" % (self.name, episode['id']))
-                    elif feed_image:
-                        image = feed_image
-                        self.logger.debug("%s/%s: Using feed image" % (self.name, episode['id']))
-                    else:
-                        self.logger.warning("%s/%s: No feed or episode image" % (self.name, episode['id']))
-                        image = None
-                    entry = Episode(author=episode.get('author', self.name),
-                                    episode_id=episode['id'],
-                                    file_name=None,
-                                    image=image,
-                                    link=links[0]['href'],
-                                    podcast=self,
-                                    published=published,
-                                    status=None,
-                                    title=episode['title'])
-                    entry.save()
-                    added += 1
+            if links and episode['id'] not in known:
+                if 'image' in episode and 'href' in episode['image']['href']:
+                    image = episode['image']['href']
+                    self.logger.debug("%s/%s: Using episode image" % (self.name, episode['id']))
+                elif feed_image:
+                    image = feed_image
+                    self.logger.debug("%s/%s: Using feed image" % (self.name, episode['id']))
+                else:
+                    self.logger.warning("%s/%s: No feed or episode image" % (self.name, episode['id']))
+                    image = None
+                rows.append({'author': episode.get('author', self.name),
+                             'description': plain_text(episode.get('summary')),
+                             'episode_id': episode['id'],
+                             'file_name': None,
+                             'image': image,
+                             'link': links[0]['href'],
+                             'podcast': self.id,
+                             'published': to_utc(episode['published']),
+                             'status': None,
+                             'title': episode['title']})
+                known.add(episode['id'])
+        ids = {}
+        with self._meta.database.atomic():
+            for batch in chunked(rows, INSERT_BATCH_SIZE):
+                Episode.insert_many(batch).execute()
+            # INSERT ... RETURNING needs SQLite 3.35, so the ids are read back
+            for batch in chunked([x['episode_id'] for x in rows], LOOKUP_BATCH_SIZE):
+                query = (Episode.select(Episode.episode_id, Episode.id)
+                         .where(Episode.podcast == self, Episode.episode_id.in_(batch)))
+                ids.update(query.tuples())
+            added = len(rows)
+            if added:
+                Revision.bump('episodes')
+        # Published once committed, so a client that fetches an episode finds it
+        for row in rows:
+            events.publish('episode_added', episode=ids[row['episode_id']], podcast=self.id,
+                           guid=row['episode_id'], title=row['title'])
+        metrics.PHASE_SECONDS.observe(time.perf_counter() - start, phase='ingest')
+        self.save_validators()
         return added
 
-    def download_new(self, base_dir):
-        """ Download new episode for a podcast
+    @staticmethod
+    def known_episode_ids(episode_ids):
+        """ Find which episode ids are already in the database
+
+            Episode ids are unique across all podcasts, the lookup is
+            done in batches to stay below SQLite's variable limit. The
+            archived episodes are known too.
 
             Args:
-                base_dir: The base directory
+                episode_ids (list): The episode ids from a feed
+
+            Returns:
+                set: The episode ids already stored
+        """
+        from .episode import Episode
+        from .retention import ArchivedEpisode
 
+        known = set()
+        for batch in chunked(episode_ids, LOOKUP_BATCH_SIZE // 2):
+            query = (Episode.select(Episode.episode_id).where(Episode.episode_id.in_(batch))
+                     | ArchivedEpisode.select(ArchivedEpisode.episode_id)
+                     .where(ArchivedEpisode.episode_id.in_(batch)))
+            known.update(x[0] for x in query.tuples())
+        return known
+
+    def recent_episode_ids(self, limit=RECENT_IDS_LIMIT):
+        """ Find the ids of the most recently published episodes
+
+            Args:
+                limit (int): The number of episodes
+
+            Returns:
+                set: The episode ids
         """
         from .episode import Episode
-        downloaded = 0
-        max_age = timeparse(self.max_age)
-        earliest = datetime.now() - timedelta(seconds=max_age)
-        episodes = Episode.select().where(Episode.podcast == self)
-        episodes = [x for x in episodes]
-        sorted_entries = sorted(episodes, key=lambda k: parser.parse(k.published))
-        for episode in sorted_entries[-self.max_episodes:]:
-            if not episode.status:
-                episode_date = parser.parse(episode.published)
-                if episode_date.tzinfo is None or episode_date.tzinfo.utcoffset(episode_date) is None:
-                    episode_date = pytz.utc.localize(episode_date)
-                if episode_date > pytz.utc.localize(earliest):
-                    episode.download(base_dir)
-                    downloaded += 1
-        return downloaded
+        query = (Episode.select(Episode.episode_id)
+                 .where(Episode.podcast == self)
+                 .order_by(Episode.published.desc())
+                 .limit(limit))
+        return {x[0] for x in query.tuples()}
+
+    def save_validators(self):
+        """ Save the feed validators from the last fetch, if they changed
+        """
+        if not self.validators_changed:
+            return
+        query = Podcast.update(content_hash=self.content_hash,
+                               etag=self.etag,
+                               last_modified=self.last_modified)
+        query.where(Podcast.id == self.id).execute()
+        self.validators_changed = False
+
+    def pending_episodes(self):
+        """ Find the episodes that should be downloaded
+
+            The newest max_episodes episodes not yet downloaded
+            and published within max_age.
+
+            Returns:
+                list: The episodes, oldest first, with this podcast
+                    set so they do not each query for it
+        """
+        from .episode import Episode
+        query = (Episode.select()
+                 .where(Episode.id.in_(self.newest_episode_ids()),
+                        Episode.status.is_null(),
+                        Episode.published > self.earliest())
+                 .order_by(Episode.published, Episode.id))
+        episodes = list(query)
+        for episode in episodes:
+            episode.podcast = self
+        return episodes
 
     def remove_expired_episodes(self):
         """ Remove expired episodes for a podcast
+
+            Downloaded episodes older than max_age or no longer
+            amongst the newest max_episodes are removed.
+
+            Returns:
+                int: The number of episodes removed
         """
         from .episode import Episode
         removed = 0
-        max_age = timeparse(self.max_age)
-        earliest = datetime.now() - timedelta(seconds=max_age)
-        episodes = Episode.select().where(Episode.podcast == self)
-        sorted_entries = sorted(episodes, key=lambda k: parser.parse(k.published))
-        for episode in sorted_entries:
-            if episode.status == 'downloaded':
-                episode_date = parser.parse(episode.published)
-                if episode_date < pytz.utc.localize(earliest):
-                    episode.delete()
-                    removed += 1
-        for episode in sorted_entries[0:-self.max_episodes]:
-            if episode.status == 'downloaded':
-                episode.delete()
-                removed += 1
+        query = (Episode.select()
+                 .where(Episode.podcast == self,
+                        Episode.status == 'downloaded',
+                        (Episode.published < self.earliest())
+                        | Episode.id.not_in(self.newest_episode_ids()))
+                 .order_by(Episode.published, Episode.id))
+        for episode in query:
+            episode.delete()
+            removed += 1
         return removed
+
+    def earliest(self):
+        """ The publication time before which episodes have expired
+
+            Returns:
+                datetime: The time in UTC
+        """
+        return utc_now() - timedelta(seconds=timeparse(self.max_age))
+
+    def newest_episode_ids(self):
+        """ A subquery for the ids of the newest max_episodes episodes
+
+            Returns:
+                Select: The subquery
+        """
+        from .episode import Episode
+        return (Episode.select(Episode.id)
+                .where(Episode.podcast == self)
+                .order_by(Episode.published.desc(), Episode.id.desc())
+                .limit(self.max_episodes))
@@ -0,0 +1,218 @@
+""" Move old episodes out of the episode table
+
+    Every entry ever seen in a feed is kept so it is not added again, but
+    only a podcast's recent episodes are read. Episodes that were removed
+    or never downloaded, published before RETENTION_MAX_AGE and their
+    podcast's max_age, and not amongst its newest RETENTION_KEEP_EPISODES,
+    are moved to an archive that keeps little more than their GUID.
+    Ingestion looks GUIDs up in both tables. The pages freed are returned
+    to the filesystem with incremental vacuum, a few at a time so the
+    API and updates are not held up.
+"""
+import logging
+import os
+import time
+from datetime import timedelta
+
+from peewee import DateTimeField, ForeignKeyField, ModelDelete, TextField, Value, chunked, fn
+from pytimeparse.timeparse import timeparse
+
+from .base_model import BaseModel, db
+from .episode import Episode
+from .podcast import Podcast, LOOKUP_BATCH_SIZE, RECENT_IDS_LIMIT
+from .revision import Revision
+from .utils import utc_now
+
+DEFAULT_MAX_AGE = '180d'
+# The pages freed in each step of an incremental vacuum, and the pause between steps
+VACUUM_PAGES = 1000
+VACUUM_PAUSE = 0.05
+AUTO_VACUUM_INCREMENTAL = 2
+
+class ArchivedEpisode(BaseModel):
+    """ An episode moved out of the episode table, keyed by its GUID
+    """
+    episode_id = TextField(primary_key=True)
+    podcast = ForeignKeyField(Podcast, backref='archived')
+    title = TextField()
+    published = DateTimeField()
+    status = TextField(null=True)
+    archived = DateTimeField()
+
+    class Meta: # pylint: disable=C1001, W0232, R0903
+        """ http://docs.peewee-orm.com/en/latest/peewee/models.html#model-options
+        """
+        table_name = 'episode_archive'
+        without_rowid = True
+
+def pragma(name, database=db):
+    """ Read a pragma's value
+
+        Args:
+            name (str): The pragma
+            database (Database): The database
+
+        Returns:
+            int: The value
+    """
+    return database.execute_sql("PRAGMA %s" % name).fetchone()[0]
+
+def report(database=db):
+    """ Describe the size of the database
+
+        Args:
+            database (Database): The database
+
+        Returns:
+            dict: The bytes on disk, used and free, and the episodes by status
+                along with those archived
+    """
+    page_size = pragma('page_size', database)
+    pages = pragma('page_count', database)
+    free = pragma('freelist_count', database)
+    paths = [database.database, "%s-wal" % database.database]
+    statuses = Episode.select(Episode.status, fn.COUNT(Episode.id)).group_by(Episode.status)
+    return {'file_bytes': sum(os.path.getsize(x) for x in paths if os.path.exists(x)),
+            'used_bytes': (pages - free) * page_size,
+            'free_bytes': free * page_size,
+            'episodes': {status or 'none': count for status, count in statuses.tuples()},
+            'archived': ArchivedEpisode.select().count()}
+
+class Retention:
+    """ Archive the episodes no longer needed and vacuum the database
+    """
+    def __init__(self, max_age=DEFAULT_MAX_AGE, keep=RECENT_IDS_LIMIT, vacuum_pages=VACUUM_PAGES,
+                 vacuum_pause=VACUUM_PAUSE, logger=None):
+        """ Init the retention policy
+
+            Args:
+                max_age (str): Only episodes published longer ago than this are archived
+                keep (int): The newest episodes of each podcast that are never archived,
+                    at least the podcast's max_episodes are always kept
+                vacuum_pages (int): The pages freed in each step of the vacuum
+                vacuum_pause (float): The seconds between steps
+
+        """
+        self.max_age = timeparse(max_age)
+        self.keep = keep
+        self.vacuum_pages = vacuum_pages
+        self.vacuum_pause = vacuum_pause
+        self.logger = logger or logging.getLogger(__name__)
+
+    @classmethod
+    def from_settings(cls, settings):
+        """ Build the retention policy from the settings
+
+            Args:
+                settings (obj): The settings
+
+            Returns:
+                Retention: The policy
+        """
+        return cls(max_age=getattr(settings, 'RETENTION_MAX_AGE', DEFAULT_MAX_AGE),
+                   keep=getattr(settings, 'RETENTION_KEEP_EPISODES', RECENT_IDS_LIMIT))
+
+    def expired(self, podcast, now):
+        """ A query for the ids of a podcast's episodes that can be archived
+
+            Args:
+                podcast (Podcast): The podcast
+                now (datetime): The current time in UTC
+
+            Returns:
+                Select: The query
+        """
+        cutoff = min(now - timedelta(seconds=self.max_age), podcast.earliest())
+        newest = (Episode.select(Episode.id)
+                  .where(Episode.podcast == podcast)
+                  .order_by(Episode.published.desc(), Episode.id.desc())
+                  .limit(max(self.keep, podcast.max_episodes)))
+        return (Episode.select(Episode.id)
+                .where(Episode.podcast == podcast,
+                       Episode.status.is_null() | (Episode.status == 'removed'),
+                       Episode.published < cutoff,
+                       Episode.id.not_in(newest)))
+
+    def archive(self, podcast, now):
+        """ Move a podcast's expired episodes to the archive
+
+            Each batch is its own transaction, so updates are not held up.
+
+            Args:
+                podcast (Podcast): The podcast
+                now (datetime): The current time in UTC
+
+            Returns:
+                int: The number of episodes archived
+        """
+        ids = [x[0] for x in self.expired(podcast, now).tuples()]
+        for batch in chunked(ids, LOOKUP_BATCH_SIZE):
+            rows = (Episode.select(Episode.episode_id, Episode.podcast, Episode.title,
+                                   Episode.published, Episode.status, Value(now))
+                    .where(Episode.id.in_(batch)))
+            with db.atomic():
+                (ArchivedEpisode
+                 .insert_from(rows, [ArchivedEpisode.episode_id, ArchivedEpisode.podcast,
+                                     ArchivedEpisode.title, ArchivedEpisode.published,
+                                     ArchivedEpisode.status, ArchivedEpisode.archived])
+                 .on_conflict_ignore()
+                 .execute())
+                # Episode.delete removes an episode's file
+                ModelDelete(Episode).where(Episode.id.in_(batch)).execute()
+        if ids:
+            self.logger.debug("%s: Archived %s episodes" % (podcast.name, len(ids)))
+        return len(ids)
+
+    def vacuum(self):
+        """ Return the free pages to the filesystem
+
+            A database created before incremental vacuum was enabled is
+            converted with a full VACUUM, once.
+
+            Returns:
+                int: The pages freed
+        """
+        before = pragma('freelist_count')
+        if pragma('auto_vacuum') != AUTO_VACUUM_INCREMENTAL:
+            self.logger.info("Enabling incremental vacuum, a full VACUUM is needed once")
+            db.execute_sql("PRAGMA auto_vacuum = INCREMENTAL")
+            db.execute_sql("VACUUM")
+        free = pragma('freelist_count')
+        while free:
+            # The sqlite3 module steps a statement that returns no rows only
+            # once, which frees a single page, executescript runs it to the end
+            db.connection().executescript("PRAGMA incremental_vacuum(%d)" % self.vacuum_pages)
+            remaining = pragma('freelist_count')
+            if remaining >= free:
+                break
+            free = remaining
+            if free:
+                time.sleep(self.vacuum_pause)
+        db.execute_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+        return before - free
+
+    def run(self, counts=None):
+        """ Archive the expired episodes of every podcast and vacuum
+
+            Args:
+                counts (dict): A dict to keep the results in
+
+            Returns:
+                dict: The report before and after, the episodes archived,
+                    the pages freed and the seconds taken
+        """
+        if counts is None:
+            counts = {}
+        start = time.perf_counter()
+        counts['before'] = report()
+        now = utc_now()
+        counts['archived'] = sum(self.archive(x, now) for x in Podcast.select())
+        if counts['archived']:
+            Revision.bump('episodes')
+        counts['vacuumed_pages'] = self.vacuum()
+        counts['after'] = report()
+        counts['seconds'] = round(time.perf_counter() - start, 3)
+        self.logger.info("Archived: %s episodes, Database: %s to %s bytes"
+                         % (counts['archived'], counts['before']['file_bytes'],
+                            counts['after']['file_bytes']))
+        return counts
@@ -0,0 +1,39 @@
+""" The Revision class
+"""
+from peewee import IntegerField, TextField
+
+from .base_model import BaseModel
+
+
+class Revision(BaseModel):
+    """ A change counter for each collection exposed by the API
+    """
+    collection = TextField(primary_key=True)
+    value = IntegerField(default=0)
+
+    @classmethod
+    def bump(cls, *collections):
+        """ Record a change to one or more collections
+
+            Args:
+                collections (str): The collections that changed
+
+        """
+        for collection in collections:
+            query = (cls.insert(collection=collection, value=1)
+                     .on_conflict(conflict_target=[cls.collection],
+                                  update={cls.value: cls.value + 1}))
+            query.execute()
+
+    @classmethod
+    def current(cls, collection):
+        """ Get the current revision of a collection
+
+            Args:
+                collection (str): The collection
+
+            Returns:
+                int: The revision
+        """
+        revision = cls.get_or_none(cls.collection == collection)
+        return revision.value if revision else 0
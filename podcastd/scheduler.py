@@ -0,0 +1,218 @@
+""" The update job scheduler
+"""
+import itertools
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+from pytimeparse.timeparse import timeparse
+
+from . import events
+from .podcast import Podcast
+from .retention import Retention
+from .updater import Updater
+from .sync import Sync, resolve_target
+from .utils import slack
+
+HISTORY = 50
+
+def run_update(settings, podcast_ids=None, totals=None, logger=None, force=False):
+    """ Run an update and report the results
+
+        Args:
+            settings (obj): The settings
+            podcast_ids (list): The podcasts to update, None for a full update
+            totals (dict): A dict to keep the running totals in
+            logger (Logger): The logger for the summary
+            force (bool): True for a full update of all podcasts, due or not
+
+        Returns:
+            dict: The totals
+    """
+    logger = logger or logging.getLogger(__name__)
+    podcasts = None
+    if podcast_ids is not None:
+        podcasts = list(Podcast.select().where(Podcast.id.in_(podcast_ids)))
+    totals = Updater(settings=settings).run(podcasts=podcasts, totals=totals, force=force)
+    logger.info("Polled: %s, Not due: %s, Added: %s, Downloaded: %s, Reused: %s, Removed: %s, Unchanged feeds: %s"
+                % (totals['polled'], totals['not_due'], totals['added'], totals['downloaded'],
+                   totals['reused'], totals['removed'], totals['skipped']))
+    if podcast_ids is None and settings.SLACK_URL:
+        slack(added=totals['added'], removed=totals['removed'], downloaded=totals['downloaded'],
+              skipped=totals['skipped'], polled=totals['polled'], not_due=totals['not_due'],
+              webhook_url=settings.SLACK_URL)
+    return totals
+
+class Job:
+    """ An update of all podcasts or of some podcasts, a sync to a player
+        or the archival of old episodes
+    """
+    ids = itertools.count(1)
+
+    def __init__(self, podcast_ids=None, kind='update', target=None):
+        """ Init the job
+
+            Args:
+                podcast_ids (list): The podcasts to update, None for a full update
+                kind (str): update, sync or compact
+                target (str): The sync target
+
+        """
+        self.id = next(self.ids)
+        self.kind = kind
+        self.podcast_ids = podcast_ids
+        self.target = target
+        self.state = 'queued'
+        self.triggers = 1
+        self.queued = time.time()
+        self.started = None
+        self.finished = None
+        self.counts = {}
+        self.error = None
+
+    @property
+    def full(self):
+        """ True if the job updates every podcast
+        """
+        return self.kind == 'update' and self.podcast_ids is None
+
+    @property
+    def key(self):
+        """ Jobs with the same key do the same work
+        """
+        return self.kind, self.podcast_ids, self.target
+
+    def to_dict(self):
+        """ Describe the job
+
+            Returns:
+                dict: The job
+        """
+        end = self.finished or time.time()
+        return {'id': self.id,
+                'kind': self.kind,
+                'podcasts': self.podcast_ids,
+                'target': self.target,
+                'state': self.state,
+                'triggers': self.triggers,
+                'queued': self.queued,
+                'started': self.started,
+                'finished': self.finished,
+                'seconds': round(end - self.started, 3) if self.started else None,
+                'counts': dict(self.counts),
+                'error': self.error}
+
+class Scheduler:
+    """ Run update jobs one at a time on a background thread
+
+        A trigger for the same podcasts as a queued or running job
+        is merged into that job rather than queued again. Once a full
+        update finishes old episodes are archived, at most once every
+        RETENTION_INTERVAL.
+    """
+    def __init__(self, settings, logger=None):
+        """ Init the scheduler
+
+            Args:
+                settings (obj): The settings
+
+        """
+        self.settings = settings
+        self.logger = logger or logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.pending = []
+        self.running = None
+        self.history = deque(maxlen=HISTORY)
+        interval = getattr(settings, 'RETENTION_INTERVAL', '1d')
+        self.retention_interval = timeparse(interval) if interval else None
+        self.compacted = None
+        self.thread = threading.Thread(target=self.worker, name='scheduler', daemon=True)
+        self.thread.start()
+
+    def submit(self, podcast_ids=None, kind='update', target=None):
+        """ Request an update, a sync or a compaction
+
+            Args:
+                podcast_ids (list): The podcasts to update, None for a full update
+                kind (str): update, sync or compact
+                target (str): The sync target
+
+            Returns:
+                Job: The job that will cover the request
+        """
+        job = Job(podcast_ids=podcast_ids, kind=kind, target=target)
+        with self.lock:
+            for other in self.pending + [self.running]:
+                if other and other.key == job.key:
+                    other.triggers += 1
+                    self.logger.debug("Trigger merged into job %s" % other.id)
+                    return other
+            self.pending.append(job)
+        self.queue.put(job)
+        return job
+
+    def jobs(self):
+        """ Describe the recent, running and queued jobs
+
+            Returns:
+                list: The jobs, oldest first
+        """
+        with self.lock:
+            jobs = list(self.history) + [self.running] + self.pending
+        return [x.to_dict() for x in jobs if x]
+
+    def worker(self):
+        """ Run jobs as they are queued
+        """
+        while True:
+            job = self.queue.get()
+            with self.lock:
+                self.pending.remove(job)
+                self.running = job
+                job.state = 'running'
+                job.started = time.time()
+            try:
+                self.run(job)
+                job.state = 'finished'
+            except Exception as err: # pylint: disable=W0703
+                self.logger.exception("Job %s failed" % job.id)
+                job.state = 'failed'
+                job.error = str(err)
+            with self.lock:
+                job.finished = time.time()
+                self.running = None
+                self.history.append(job)
+            events.publish('%s_finished' % job.kind, job=job.to_dict())
+            if job.full and job.state == 'finished' and self.compaction_due():
+                self.submit(kind='compact')
+
+    def compaction_due(self):
+        """ Decide whether old episodes should be archived
+
+            Returns:
+                bool: True if RETENTION_INTERVAL has passed since the last compaction
+        """
+        if not self.retention_interval:
+            return False
+        return self.compacted is None or time.time() - self.compacted >= self.retention_interval
+
+    def run(self, job):
+        """ Run a job and report the results
+
+            Args:
+                job (Job): The job
+
+        """
+        if job.kind == 'compact':
+            Retention.from_settings(self.settings).run(counts=job.counts)
+            self.compacted = time.time()
+            return
+        if job.kind == 'sync':
+            target = resolve_target(self.settings, job.target, allow_paths=False)
+            Sync(base_dir=self.settings.BASE_DIR, target=target,
+                 fsync_every=getattr(self.settings, 'SYNC_FSYNC_EVERY', 0)).run(counts=job.counts)
+            return
+        run_update(self.settings, podcast_ids=job.podcast_ids, totals=job.counts, logger=self.logger)
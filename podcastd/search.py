@@ -0,0 +1,148 @@
+""" Full text search over the episodes
+
+    An FTS5 table indexes each episode's title, author and description
+    along with its podcast's name. Triggers on the episode and podcast
+    tables keep it up to date, so ingestion and the API need not know it
+    exists. Results are ranked with bm25, a title match counting the most,
+    and paged with a cursor of the last result's score and id.
+"""
+import logging
+
+from playhouse.sqlite_ext import FTS5Model, SearchField
+
+from .base_model import db
+from .episode import Episode
+from .serialize import serialize
+
+# pylint: disable=C0103
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMIT = 20
+# The bm25 weights of the title, author, description and podcast columns
+WEIGHTS = (10.0, 2.0, 1.0, 5.0)
+
+TRIGGERS = (
+    """CREATE TRIGGER IF NOT EXISTS episode_search_insert AFTER INSERT ON episode BEGIN
+        INSERT INTO episode_search (rowid, title, author, description, podcast)
+        VALUES (new.id, new.title, new.author, new.description,
+                (SELECT name FROM podcast WHERE id = new.podcast_id));
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS episode_search_delete AFTER DELETE ON episode BEGIN
+        DELETE FROM episode_search WHERE rowid = old.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS episode_search_update
+    AFTER UPDATE OF title, author, description, podcast_id ON episode BEGIN
+        DELETE FROM episode_search WHERE rowid = old.id;
+        INSERT INTO episode_search (rowid, title, author, description, podcast)
+        VALUES (new.id, new.title, new.author, new.description,
+                (SELECT name FROM podcast WHERE id = new.podcast_id));
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS podcast_search_update AFTER UPDATE OF name ON podcast BEGIN
+        UPDATE episode_search SET podcast = new.name
+        WHERE rowid IN (SELECT id FROM episode WHERE podcast_id = new.id);
+    END""",
+)
+
+class EpisodeSearch(FTS5Model):
+    """ The full text index of the episodes, the rowid is the episode's id
+    """
+    title = SearchField()
+    author = SearchField()
+    description = SearchField()
+    podcast = SearchField()
+
+    class Meta: # pylint: disable=C1001, W0232, R0903
+        """ http://docs.peewee-orm.com/en/latest/peewee/sqlite_ext.html#FTS5Model
+        """
+        database = db
+        table_name = 'episode_search'
+        options = {'tokenize': 'unicode61 remove_diacritics 2'}
+
+def create_index(database):
+    """ Create the index and its triggers, filling it when it is new
+
+        Args:
+            database (Database): The database
+
+    """
+    if not EpisodeSearch.table_exists():
+        database.create_tables([EpisodeSearch])
+        count = database.execute_sql(
+            "INSERT INTO episode_search (rowid, title, author, description, podcast)"
+            " SELECT episode.id, episode.title, episode.author, episode.description, podcast.name"
+            " FROM episode JOIN podcast ON podcast.id = episode.podcast_id").rowcount
+        logger.info("Indexed %s episodes for search" % count)
+    for trigger in TRIGGERS:
+        database.execute_sql(trigger)
+
+def match_expression(text):
+    """ Build an FTS5 query that matches every word of some text
+
+        Each word is quoted so the text can not be read as FTS5 syntax,
+        a word ending in * matches as a prefix.
+
+        Args:
+            text (str): The text
+
+        Returns:
+            str: The query, None if the text has no words
+    """
+    terms = []
+    for word in text.split():
+        prefix = word.endswith('*')
+        word = word.rstrip('*')
+        if word:
+            terms.append('"%s"%s' % (word.replace('"', '""'), '*' if prefix else ''))
+    return ' '.join(terms) or None
+
+def parse_cursor(value):
+    """ Parse the cursor of the last result on the previous page
+
+        Args:
+            value (str): The score and id, separated by a colon
+
+        Returns:
+            tuple: The score and id, None for the first page
+    """
+    if value is None:
+        return None
+    score, _sep, episode_id = value.partition(':')
+    try:
+        return float(score), int(episode_id)
+    except ValueError:
+        raise ValueError("Invalid cursor: %s" % value)
+
+def search(text, query=None, limit=DEFAULT_LIMIT, after=None):
+    """ Find the episodes matching some text, best match first
+
+        Args:
+            text (str): The words to look for
+            query (Select): The episodes to search, all episodes if None
+            limit (int): The number of results
+            after (tuple): The score and id of the last result on the previous page
+
+        Returns:
+            tuple: The results as dicts with their score, and the cursor for the
+                next page or None
+    """
+    expression = match_expression(text)
+    if expression is None:
+        raise ValueError("Nothing to search for")
+    score = EpisodeSearch.bm25(*WEIGHTS)
+    query = query if query is not None else Episode.select()
+    # The best matches are found from the index and the episode ids alone,
+    # only they are joined with the rest of their columns
+    best = (query.select(Episode.id, score.alias('score'))
+            .join_from(Episode, EpisodeSearch, on=(EpisodeSearch.rowid == Episode.id))
+            .where(EpisodeSearch.match(expression)))
+    if after is not None:
+        best = best.where((score > after[0]) | ((score == after[0]) & (Episode.id > after[1])))
+    best = best.order_by(score, Episode.id).limit(limit).alias('best')
+    query = (Episode.select()
+             .join(best, on=(best.c.id == Episode.id))
+             .order_by(best.c.score, Episode.id))
+    rows = list(serialize(Episode, query, extra=[('score', best.c.score)]))
+    cursor = None
+    if len(rows) == limit:
+        cursor = "%r:%s" % (rows[-1]['score'], rows[-1]['id'])
+    return rows, cursor
@@ -0,0 +1,89 @@
+""" Serialize rows for the API straight from the database
+
+    The rows are selected as tuples, joined with the row each foreign key
+    refers to, and built into the dicts model_to_dict would return without
+    a model for each row or a query for each foreign key. Timestamps are
+    formatted as ISO 8601 by SQLite, stored timestamps only differ from
+    isoformat() by the separator.
+"""
+from peewee import JOIN, DateTimeField, FieldAlias, ForeignKeyField, fn
+
+def column(field):
+    """ The expression that selects a field's value as it is serialized
+
+        Args:
+            field (Field): The field, or the field of an aliased model
+
+        Returns:
+            Node: The expression
+    """
+    if isinstance(field.field if isinstance(field, FieldAlias) else field, DateTimeField):
+        return fn.REPLACE(field, ' ', 'T').coerce(False)
+    return field
+
+def columns(fields, alias=False):
+    """ The expressions that select fields as they are serialized
+
+        Args:
+            fields (list): The fields
+            alias (bool): True to name each expression after its field,
+                for rows read as dicts
+
+        Returns:
+            list: The expressions
+    """
+    if alias:
+        return [column(x).alias(x.name) for x in fields]
+    return [column(x) for x in fields]
+
+def serialize(model, query, extra=None, exclude=()):
+    """ Serialize the rows of a query, with the row each foreign key refers to
+
+        Args:
+            model (Model): The model
+            query (Select): The query, its selection is replaced
+            extra (list): The name and expression of any other values to add to each row
+            exclude (tuple): The names of fields to leave out, of the model and the related rows
+
+        Returns:
+            generator: A dict for each row, read as they are consumed
+    """
+    fields = [x for x in model._meta.sorted_fields if x.name not in exclude] # pylint: disable=W0212
+    names = [x.name for x in fields]
+    selection = columns(fields)
+    related = []
+    for field in fields:
+        if isinstance(field, ForeignKeyField):
+            rel_model = field.rel_model.alias()
+            rel_fields = [getattr(rel_model, x.name) for x in field.rel_model._meta.sorted_fields # pylint: disable=W0212
+                          if x.name not in exclude]
+            query = query.join_from(model, rel_model, JOIN.LEFT_OUTER,
+                                   on=(field == getattr(rel_model, field.rel_field.name)))
+            related.append((field.name, len(selection), [x.name for x in rel_fields]))
+            selection += columns(rel_fields)
+    extra = extra or []
+    extra_start = len(selection)
+    selection += [expression for _name, expression in extra]
+    query = query.select(*selection).tuples()
+    width = len(names)
+    for row in query.iterator():
+        result = dict(zip(names, row[:width]))
+        for name, start, rel_names in related:
+            values = row[start:start + len(rel_names)]
+            result[name] = dict(zip(rel_names, values)) if values[0] is not None else None
+        for idx, (name, _expression) in enumerate(extra):
+            result[name] = row[extra_start + idx]
+        yield result
+
+def serialize_one(model, query):
+    """ Serialize the single row of a query
+
+        Args:
+            model (Model): The model
+            query (Select): The query
+
+        Returns:
+            dict: The row, None if there is not exactly one
+    """
+    rows = list(serialize(model, query.limit(2)))
+    return rows[0] if len(rows) == 1 else None
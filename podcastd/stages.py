@@ -0,0 +1,93 @@
+""" The tag stage of an update
+
+    Downloads run in a pool of threads, the network bound stage. Each
+    downloaded file is then tagged in a small pool of processes, the CPU
+    bound stage, so resizing artwork and rewriting tags neither hold the
+    GIL from the downloads nor wait on the network. A tag job carries
+    everything the worker needs, the worker does not touch the database.
+    Artwork not yet in the cache is carried as its source image, the
+    worker resizes it and returns the JPEG for the cache.
+"""
+import multiprocessing
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from . import tagging
+from .artwork import resize
+
+DEFAULT_IMAGE = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'record.png')
+
+# pylint: disable=C0103
+TagJob = namedtuple('TagJob', 'file_name frames image source')
+
+def tag_pool(workers):
+    """ Build the pool for the tag stage
+
+        Workers are started from a fork server, forking the updater
+        itself would copy its threads' locks.
+
+        Args:
+            workers (int): The number of processes, 0 to tag in a
+                single thread of this process
+
+        Returns:
+            Executor: The pool
+    """
+    if not workers:
+        return ThreadPoolExecutor(max_workers=1)
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+    if 'forkserver' in methods:
+        context.set_forkserver_preload([__name__])
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context)
+
+def embedded_image(fname):
+    """ Read the artwork already embedded in a file
+
+        Args:
+            fname (str): The file name
+
+        Returns:
+            bytes: The image, None if the file has none
+    """
+    from eyed3 import id3
+    current_tag = id3.Tag()
+    if current_tag.parse(fname, version=id3.ID3_V2) and current_tag.images:
+        return current_tag.images[0].image_data
+    return None
+
+def apply_tags(job):
+    """ Replace the tags in a file
+
+        When the job has neither an image nor a source image the file's
+        own artwork is resized, failing that the default image is used.
+
+        Args:
+            job (TagJob): The file, its text frames and its resized artwork
+                or the source image to resize
+
+        Returns:
+            dict: The bytes written, the seconds spent on the image and on the
+                tags, whether the default image was used and the artwork
+                resized from the source image
+    """
+    start = time.perf_counter()
+    image, default, resized = job.image, False, None
+    if image is None and job.source is not None:
+        image = resized = resize(job.source)
+    elif image is None:
+        image = embedded_image(job.file_name)
+        if image is None:
+            with open(DEFAULT_IMAGE, 'rb') as fileh:
+                image, default = fileh.read(), True
+        image = resize(image)
+    image_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    written = tagging.write_tag(job.file_name, list(job.frames) + [tagging.image_frame(image)])
+    return {'written': written,
+            'image_seconds': image_seconds,
+            'tag_seconds': time.perf_counter() - start,
+            'default_image': default,
+            'image': resized}
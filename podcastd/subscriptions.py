@@ -0,0 +1,189 @@
+""" Bulk subscription import
+
+    Subscriptions can be imported from an OPML file, as exported by most
+    podcast apps, or from a JSON or YAML list or mapping of podcasts in
+    the form used by init/podcasts.yml.
+"""
+import json
+import os
+import xml.etree.ElementTree as ET
+
+from peewee import chunked
+from pytimeparse.timeparse import timeparse
+
+from .podcast import Podcast, LOOKUP_BATCH_SIZE, INSERT_BATCH_SIZE
+from .revision import Revision
+from .utils import get_valid_filename
+
+DEFAULTS = {'image': None, 'max_age': '7d', 'max_episodes': 3, 'refresh_interval': None}
+FIELDS = ('name', 'url') + tuple(DEFAULTS)
+
+def check_intervals(details):
+    """ Check the time spans in a podcast's fields
+
+        Args:
+            details (dict): The podcast's fields, those left out are not checked
+
+    """
+    for field in ('max_age', 'refresh_interval'):
+        if field in details and (details[field] or field == 'max_age') \
+                and not timeparse(str(details[field])):
+            raise ValueError("Invalid %s: %s" % (field, details[field]))
+
+def parse_opml(data):
+    """ Read the feeds from an OPML document
+
+        Args:
+            data (bytes): The document
+
+        Returns:
+            list: A dict with the name and url of each feed
+    """
+    root = ET.fromstring(data)
+    return [{'name': x.get('text') or x.get('title'), 'url': x.get('xmlUrl')}
+            for x in root.iter('outline') if x.get('xmlUrl')]
+
+def parse_list(podcasts):
+    """ Read the podcasts from a list, or a mapping of names to details
+
+        Args:
+            podcasts (list): The podcasts
+
+        Returns:
+            list: A dict for each podcast
+    """
+    if isinstance(podcasts, dict):
+        # Details that are not a mapping are left for validate to reject
+        return [dict(details or {}, name=name) if details is None or isinstance(details, dict) else details
+                for name, details in podcasts.items()]
+    if isinstance(podcasts, list):
+        return podcasts
+    raise ValueError("Expected a list or a mapping of podcasts")
+
+def parse_import(data, content_type):
+    """ Read the podcasts from an import in any supported format
+
+        Args:
+            data (bytes): The request body
+            content_type (str): The request's content type
+
+        Returns:
+            list: A dict for each podcast
+    """
+    content_type = (content_type or '').lower()
+    if 'xml' in content_type or 'opml' in content_type or data.lstrip().startswith(b'<'):
+        try:
+            return parse_opml(data)
+        except ET.ParseError as err:
+            raise ValueError("Invalid OPML: %s" % err)
+    if 'yaml' in content_type:
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError("Importing YAML requires pyyaml")
+        try:
+            return parse_list(yaml.safe_load(data))
+        except yaml.YAMLError as err:
+            raise ValueError("Invalid YAML: %s" % err)
+    try:
+        return parse_list(json.loads(data.decode('utf-8')))
+    except (UnicodeDecodeError, json.JSONDecodeError) as err:
+        raise ValueError("Invalid JSON: %s" % err)
+
+def validate(item, defaults):
+    """ Build the row for a podcast to import
+
+        Args:
+            item (dict): The podcast
+            defaults (dict): The values for the fields the podcast leaves out
+
+        Returns:
+            dict: The row
+    """
+    if not isinstance(item, dict):
+        raise ValueError("Expected an object")
+    row = {x: item.get(x, defaults.get(x)) for x in FIELDS}
+    # A YAML key such as 1619 is read as a number
+    if isinstance(row['name'], (int, float)) and not isinstance(row['name'], bool):
+        row['name'] = str(row['name'])
+    for field in ('name', 'url'):
+        if row[field] is not None and not isinstance(row[field], str):
+            raise ValueError("Invalid %s: %s" % (field, row[field]))
+    if not row['name'] or not row['url']:
+        raise ValueError("A name and url are required")
+    try:
+        row['max_episodes'] = int(row['max_episodes'])
+    except (TypeError, ValueError):
+        raise ValueError("Invalid max_episodes: %s" % row['max_episodes'])
+    check_intervals(row)
+    return row
+
+def existing(field, values):
+    """ Find which values of a field are already subscribed
+
+        Args:
+            field (Field): The Podcast field
+            values (list): The values to look for
+
+        Returns:
+            set: The values found
+    """
+    found = set()
+    for batch in chunked(values, LOOKUP_BATCH_SIZE):
+        found.update(x[0] for x in Podcast.select(field).where(field.in_(batch)).tuples())
+    return found
+
+def import_podcasts(items, base_dir, defaults=None):
+    """ Subscribe to podcasts in a single transaction
+
+        A podcast whose name or url is already subscribed, or appears
+        earlier in the import, is reported as a duplicate.
+
+        Args:
+            items (list): A dict for each podcast
+            base_dir (str): The base directory to build their directories in
+            defaults (dict): Values for the fields the podcasts leave out
+
+        Returns:
+            list: The result for each item, in order
+    """
+    defaults = dict(DEFAULTS, **(defaults or {}))
+    results = []
+    rows = []
+    for item in items:
+        try:
+            row = validate(item, defaults)
+            rows.append(row)
+            results.append({'name': row['name'], 'url': row['url'], 'status': 'added', 'row': row})
+        except ValueError as err:
+            name = item.get('name') if isinstance(item, dict) else None
+            results.append({'name': name, 'status': 'invalid', 'error': str(err)})
+    with Podcast._meta.database.atomic():
+        names = existing(Podcast.name, [x['name'] for x in rows])
+        urls = existing(Podcast.url, [x['url'] for x in rows])
+        new = []
+        for result in results:
+            row = result.pop('row', None)
+            if row is None:
+                continue
+            if row['name'] in names or row['url'] in urls:
+                result['status'] = 'duplicate'
+                continue
+            names.add(row['name'])
+            urls.add(row['url'])
+            new.append(row)
+        for batch in chunked(new, INSERT_BATCH_SIZE):
+            Podcast.insert_many(batch).execute()
+        ids = {}
+        for batch in chunked([x['name'] for x in new], LOOKUP_BATCH_SIZE):
+            query = Podcast.select(Podcast.name, Podcast.id).where(Podcast.name.in_(batch))
+            ids.update(query.tuples())
+        if new:
+            Revision.bump('podcasts')
+        # Built before the commit, a podcast is not added without its directory
+        for row in new:
+            os.makedirs(os.path.join(base_dir, get_valid_filename(row['name'])), exist_ok=True)
+    for result in results:
+        if result['status'] == 'added':
+            result['id'] = ids[result['name']]
+    return results
@@ -0,0 +1,263 @@
+""" Incremental sync to an mp3 player
+
+    A manifest kept on each target lists the episodes copied to it. A sync
+    compares the manifest with the downloaded episodes in the database and
+    only copies new episodes and removes expired ones, neither tree is
+    walked. The first sync to a target without a manifest adopts files
+    already there when their size matches.
+"""
+import json
+import logging
+import os
+import shutil
+import time
+
+from .episode import Episode
+
+MANIFEST = '.podcastd-manifest.json'
+MANIFEST_VERSION = 1
+
+def fsync_path(path):
+    """ Flush a file, or the entries of a directory, to the disk
+
+        Args:
+            path (str): The file or directory
+
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class SyncError(Exception):
+    """ Raised when a target can not be synced
+    """
+
+def resolve_target(settings, name=None, allow_paths=True):
+    """ Find the directory for a sync target
+
+        Args:
+            settings (obj): The settings
+            name (str): A name from SYNC_TARGETS or a directory, None
+                when there is a single target
+            allow_paths (bool): False to only accept names from SYNC_TARGETS
+
+        Returns:
+            str: The directory
+    """
+    targets = getattr(settings, 'SYNC_TARGETS', {})
+    if name is None:
+        if not targets:
+            raise SyncError("Name a directory to sync to, no SYNC_TARGETS are configured")
+        if len(targets) != 1:
+            raise SyncError("Name one of the sync targets: %s" % ", ".join(sorted(targets)))
+        name = next(iter(targets))
+    if not allow_paths and name not in targets:
+        raise SyncError("Unknown sync target: %s" % name)
+    path = targets.get(name, name)
+    if not os.path.isdir(os.path.expanduser(path)):
+        raise SyncError("Sync target not available: %s" % path)
+    return os.path.expanduser(path)
+
+class Sync:
+    """ Sync the downloaded episodes to a target directory
+    """
+    def __init__(self, base_dir, target, fsync_every=0, logger=None):
+        """ Init the sync
+
+            Args:
+                base_dir (str): The directory the episodes are downloaded to
+                target (str): The directory on the player
+                fsync_every (int): Flush to the target after this many copies,
+                    1 for every file, 0 to leave it to the OS
+
+        """
+        self.base_dir = base_dir
+        self.target = target
+        self.fsync_every = fsync_every
+        self.logger = logger or logging.getLogger(__name__)
+        self.manifest_path = os.path.join(target, MANIFEST)
+        # The copies not yet flushed to the target
+        self.unflushed = []
+
+    def load_manifest(self):
+        """ Load the manifest from the target
+
+            Returns:
+                dict: Each relative path on the target and its size and episode id, None
+                    if the target has no manifest
+        """
+        try:
+            with open(self.manifest_path) as fileh:
+                manifest = json.load(fileh)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            self.logger.warning("Ignoring a corrupt manifest: %s" % self.manifest_path)
+            return None
+        if manifest.get('version') != MANIFEST_VERSION:
+            return None
+        return manifest['files']
+
+    def save_manifest(self, files):
+        """ Save the manifest to the target
+
+            Args:
+                files (dict): Each relative path on the target and its size and episode id
+
+        """
+        part = self.manifest_path + '.part'
+        with open(part, 'w') as fileh:
+            json.dump({'version': MANIFEST_VERSION, 'files': files}, fileh)
+            fileh.flush()
+            if self.fsync_every:
+                os.fsync(fileh.fileno())
+        os.replace(part, self.manifest_path)
+        if self.fsync_every:
+            fsync_path(self.target)
+
+    def wanted(self):
+        """ The downloaded episodes that belong on the target
+
+            Returns:
+                dict: The source file of each relative path, with its episode id
+        """
+        query = (Episode.select(Episode.id, Episode.file_name)
+                 .where(Episode.status == 'downloaded', Episode.file_name.is_null(False)))
+        wanted = {}
+        for episode_id, file_name in query.tuples():
+            relative = os.path.relpath(file_name, self.base_dir).replace(os.sep, '/')
+            if not relative.startswith('../'):
+                wanted[relative] = (file_name, episode_id)
+        return wanted
+
+    def adopt(self, wanted):
+        """ Build a manifest from the files already on a target
+
+            Only the paths that are wanted are checked.
+
+            Args:
+                wanted (dict): The source file of each relative path, with its episode id
+
+            Returns:
+                dict: The manifest entries for the files already in place
+        """
+        files = {}
+        for relative, (source, episode_id) in wanted.items():
+            try:
+                size = os.path.getsize(os.path.join(self.target, relative))
+                if size == os.path.getsize(source):
+                    files[relative] = {'size': size, 'episode': episode_id}
+            except OSError:
+                continue
+        self.logger.info("Adopted %s files already on %s" % (len(files), self.target))
+        return files
+
+    def copy(self, source, relative):
+        """ Copy an episode to the target
+
+            Args:
+                source (str): The source file
+                relative (str): The path on the target
+
+            Returns:
+                int: The number of bytes copied
+        """
+        destination = os.path.join(self.target, relative)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        part = destination + '.part'
+        with open(source, 'rb') as src, open(part, 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+            if self.fsync_every == 1:
+                dst.flush()
+                os.fsync(dst.fileno())
+            size = dst.tell()
+        os.replace(part, destination)
+        if self.fsync_every:
+            self.unflushed.append(destination)
+        return size
+
+    def remove(self, relative):
+        """ Remove an episode from the target, and its directory when empty
+
+            Args:
+                relative (str): The path on the target
+
+        """
+        destination = os.path.join(self.target, relative)
+        try:
+            os.remove(destination)
+        except FileNotFoundError:
+            pass
+        try:
+            os.rmdir(os.path.dirname(destination))
+        except OSError:
+            pass
+
+    def flush(self, files):
+        """ Flush the copies so far to the target and record them
+
+            Only the copies and the directories they were renamed in are
+            flushed, not every filesystem.
+
+            Args:
+                files (dict): The manifest
+
+        """
+        directories = set()
+        for path in self.unflushed:
+            # With fsync_every at 1 each copy was flushed as it was written
+            if self.fsync_every > 1:
+                fsync_path(path)
+            directories.add(os.path.dirname(path))
+        for directory in sorted(directories):
+            fsync_path(directory)
+        self.unflushed = []
+        self.save_manifest(files)
+
+    def run(self, counts=None):
+        """ Copy new episodes to the target and remove expired ones
+
+            The manifest is saved after each batch of copies, an
+            interrupted sync carries on from the last batch.
+
+            Args:
+                counts (dict): A dict to keep the running counts in
+
+            Returns:
+                dict: The files copied, removed and missing, the bytes copied and the seconds taken
+        """
+        counts = counts if counts is not None else {}
+        for key in ('copied', 'removed', 'missing', 'bytes'):
+            counts.setdefault(key, 0)
+        start = time.monotonic()
+        wanted = self.wanted()
+        files = self.load_manifest()
+        if files is None:
+            files = self.adopt(wanted)
+        for relative in sorted(set(files) - set(wanted)):
+            self.remove(relative)
+            del files[relative]
+            counts['removed'] += 1
+        pending = 0
+        for relative in sorted(set(wanted) - set(files)):
+            source, episode_id = wanted[relative]
+            if not os.path.exists(source):
+                self.logger.warning("Missing: %s" % source)
+                counts['missing'] += 1
+                continue
+            size = self.copy(source, relative)
+            files[relative] = {'size': size, 'episode': episode_id}
+            counts['copied'] += 1
+            counts['bytes'] += size
+            self.logger.debug("Copied: %s" % relative)
+            pending += 1
+            if self.fsync_every and pending >= self.fsync_every:
+                self.flush(files)
+                pending = 0
+        self.flush(files)
+        counts['seconds'] = round(time.monotonic() - start, 3)
+        self.logger.info("Synced %s: Copied: %s, Removed: %s, Missing: %s"
+                         % (self.target, counts['copied'], counts['removed'], counts['missing']))
+        return counts
@@ -0,0 +1,174 @@
+""" Write ID3v2.3 tags in a single pass
+
+    The existing ID3v2 tag at the start of a file and the ID3v1 trailer at
+    the end are replaced without parsing them. When the new tag fits in the
+    space of the old one it is written in place, otherwise the file is
+    rewritten once with the new tag and room to grow.
+"""
+import os
+import shutil
+import struct
+
+DEFAULT_PADDING = 4096
+HEADER_SIZE = 10
+V1_SIZE = 128
+V1_EXTENDED_SIZE = 227
+COPY_BUFFER = 1024 * 1024
+
+def syncsafe_decode(data):
+    """ Decode a 4 byte syncsafe integer
+
+        Args:
+            data (bytes): The encoded integer
+
+        Returns:
+            int: The integer
+    """
+    return data[0] << 21 | data[1] << 14 | data[2] << 7 | data[3]
+
+def syncsafe_encode(value):
+    """ Encode a 4 byte syncsafe integer
+
+        Args:
+            value (int): The integer
+
+        Returns:
+            bytes: The encoded integer
+    """
+    return bytes([(value >> 21) & 0x7f, (value >> 14) & 0x7f, (value >> 7) & 0x7f, value & 0x7f])
+
+def encode_text(text):
+    """ Encode a string for a frame, latin-1 when possible, otherwise UTF-16
+
+        Args:
+            text (str): The string
+
+        Returns:
+            tuple: The encoding byte and the encoded string
+    """
+    try:
+        return b'\x00', text.encode('latin-1')
+    except UnicodeEncodeError:
+        return b'\x01', text.encode('utf-16')
+
+def frame(frame_id, body):
+    """ Build an ID3v2.3 frame
+
+        Args:
+            frame_id (str): The four character frame id
+            body (bytes): The frame body
+
+        Returns:
+            bytes: The frame
+    """
+    return frame_id.encode('ascii') + struct.pack('>IH', len(body), 0) + body
+
+def text_frame(frame_id, text):
+    """ Build an ID3v2.3 text frame
+
+        Args:
+            frame_id (str): The four character frame id
+            text (str): The text
+
+        Returns:
+            bytes: The frame
+    """
+    encoding, encoded = encode_text(text or '')
+    return frame(frame_id, encoding + encoded)
+
+def image_frame(data, mime_type='image/jpeg', picture_type=3):
+    """ Build an ID3v2.3 attached picture frame
+
+        Args:
+            data (bytes): The image
+            mime_type (str): The image's mime type
+            picture_type (int): The picture type, 3 is the front cover
+
+        Returns:
+            bytes: The frame
+    """
+    return frame('APIC', b'\x00' + mime_type.encode('latin-1') + b'\x00'
+                 + bytes([picture_type]) + b'\x00' + data)
+
+def existing_tags(fileh):
+    """ Find the size of the tags already in a file
+
+        Args:
+            fileh (file): The file, opened for reading
+
+        Returns:
+            tuple: The size of the ID3v2 tag at the start, the size of the
+                ID3v1 trailer and the size of the file
+    """
+    fileh.seek(0, os.SEEK_END)
+    file_size = fileh.tell()
+    fileh.seek(0)
+    header = fileh.read(HEADER_SIZE)
+    v2_size = 0
+    if len(header) == HEADER_SIZE and header[:3] == b'ID3':
+        v2_size = HEADER_SIZE + syncsafe_decode(header[6:10])
+        if header[5] & 0x10:
+            v2_size += HEADER_SIZE
+    v1_size = 0
+    if file_size - v2_size >= V1_SIZE:
+        fileh.seek(file_size - V1_SIZE)
+        if fileh.read(3) == b'TAG':
+            v1_size = V1_SIZE
+            if file_size - v2_size >= V1_SIZE + V1_EXTENDED_SIZE:
+                fileh.seek(file_size - V1_SIZE - V1_EXTENDED_SIZE)
+                if fileh.read(4) == b'TAG+':
+                    v1_size += V1_EXTENDED_SIZE
+    return v2_size, v1_size, file_size
+
+def render(frames, size):
+    """ Render an ID3v2.3 tag padded to a size
+
+        Args:
+            frames (list): The frames
+            size (int): The total size of the tag, including the header
+
+        Returns:
+            bytes: The tag
+    """
+    body = b''.join(frames)
+    padding = b'\x00' * (size - HEADER_SIZE - len(body))
+    return b'ID3\x03\x00\x00' + syncsafe_encode(size - HEADER_SIZE) + body + padding
+
+def write_tag(file_name, frames, padding=DEFAULT_PADDING):
+    """ Replace all the tags in a file with an ID3v2.3 tag
+
+        Args:
+            file_name (str): The file
+            frames (list): The frames for the new tag
+            padding (int): The room to leave for the tag to grow when
+                the file has to be rewritten
+
+        Returns:
+            int: The number of bytes written
+    """
+    needed = HEADER_SIZE + sum(len(x) for x in frames)
+    with open(file_name, 'r+b') as fileh:
+        v2_size, v1_size, file_size = existing_tags(fileh)
+        if needed <= v2_size:
+            tag = render(frames, v2_size)
+            fileh.seek(0)
+            fileh.write(tag)
+            if v1_size:
+                fileh.truncate(file_size - v1_size)
+            return len(tag)
+        tag = render(frames, needed + padding)
+        tmp_name = "%s.tagging" % file_name
+        with open(tmp_name, 'wb') as tmph:
+            tmph.write(tag)
+            fileh.seek(v2_size)
+            remaining = file_size - v2_size - v1_size
+            while remaining > 0:
+                chunk = fileh.read(min(COPY_BUFFER, remaining))
+                if not chunk:
+                    break
+                tmph.write(chunk)
+                remaining -= len(chunk)
+            written = tmph.tell()
+    shutil.copymode(file_name, tmp_name)
+    os.replace(tmp_name, file_name)
+    return written
@@ -0,0 +1,347 @@
+""" The concurrent update engine
+"""
+import logging
+import os
+import random
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+from urllib.parse import urlparse
+
+from pytimeparse.timeparse import timeparse
+
+from .artwork import ArtworkCache
+from . import events, http_client
+from .dedupe import DedupeIndex
+from .download import DEFAULT_TIMEOUT
+from .podcast import Podcast
+from .stages import apply_tags, tag_pool
+from .utils import utc_now
+
+# Poll twice in a podcast's usual time between episodes
+CADENCE_FACTOR = 0.5
+
+
+class Updater:
+    """ Refresh every subscription
+
+        Feeds are fetched and parsed in a bounded pool of worker threads,
+        episodes are downloaded in a second pool and tagged in a pool of
+        processes. The database writes are all done on the calling thread
+        so SQLite only ever sees a single writer.
+    """
+    def __init__(self, settings, logger=None):
+        """ Init the updater
+
+            Args:
+                settings (obj): The settings
+
+        """
+        self.settings = settings
+        self.logger = logger or logging.getLogger(__name__)
+        self.max_workers = getattr(settings, 'UPDATE_CONCURRENCY', 8)
+        self.per_host = getattr(settings, 'UPDATE_PER_HOST_CONCURRENCY', 2)
+        self.download_workers = getattr(settings, 'DOWNLOAD_WORKERS', 4)
+        self.download_timeout = getattr(settings, 'DOWNLOAD_TIMEOUT', DEFAULT_TIMEOUT)
+        self.tag_workers = getattr(settings, 'TAG_WORKERS', min(2, (os.cpu_count() or 1) - 1))
+        self.tag_queue = getattr(settings, 'TAG_QUEUE_SIZE', 8)
+        self.streaming = getattr(settings, 'FEED_STREAMING', True)
+        self.dedupe = getattr(settings, 'DEDUPE_DOWNLOADS', True)
+        self.adaptive = getattr(settings, 'ADAPTIVE_POLLING', True)
+        self.poll_min = timeparse(getattr(settings, 'POLL_MIN_INTERVAL', '1h'))
+        self.poll_max = timeparse(getattr(settings, 'POLL_MAX_STALENESS', '1d'))
+        self.poll_jitter = getattr(settings, 'POLL_JITTER', 0.1)
+        if getattr(settings, 'FEED_PARSE_PROFILE', False) and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self._hosts = {}
+        self._hosts_lock = threading.Lock()
+
+    @staticmethod
+    def host(url):
+        """ Return the host for a url
+
+            Args:
+                url (str): A url
+
+            Returns:
+                str: The lower cased host
+        """
+        return urlparse(url).netloc.lower()
+
+    def host_semaphore(self, url):
+        """ Return the semaphore limiting requests to the host of a url
+
+            Args:
+                url (str): A url
+
+            Returns:
+                BoundedSemaphore: The semaphore for the host
+        """
+        host = self.host(url)
+        with self._hosts_lock:
+            if host not in self._hosts:
+                self._hosts[host] = threading.BoundedSemaphore(self.per_host)
+            return self._hosts[host]
+
+    def interleave(self, podcasts):
+        """ Order podcasts round robin by host
+
+            This keeps the workers from all queueing on the same host
+            while the per host limit is held.
+
+            Args:
+                podcasts (list): The podcasts
+
+            Returns:
+                list: The podcasts, interleaved by host
+        """
+        by_host = OrderedDict()
+        for podcast in podcasts:
+            by_host.setdefault(self.host(podcast.url), []).append(podcast)
+        ordered = []
+        while by_host:
+            for host in list(by_host):
+                ordered.append(by_host[host].pop(0))
+                if not by_host[host]:
+                    del by_host[host]
+        return ordered
+
+    def fetch(self, podcast, known_ids):
+        """ Fetch a feed, respecting the per host limit
+
+            Args:
+                podcast (Podcast): The podcast
+                known_ids (set): Ids of the newest episodes already stored,
+                    None to parse the whole feed
+
+            Returns:
+                FeedParserDict: The parsed feed
+        """
+        with self.host_semaphore(podcast.url):
+            return podcast.fetch_feed(known_ids=known_ids)
+
+    def run(self, podcasts=None, totals=None, force=False):
+        """ Update the podcasts
+
+            Feed fetches, episode downloads and tagging run in their own
+            pools, as each completes the results are written to the
+            database from this thread. Downloaded episodes wait in a
+            bounded queue for the tag stage, downloads are held back
+            while it is full.
+
+            Args:
+                podcasts (list): The podcasts to update, defaults to all
+                    podcasts due a refresh
+                totals (dict): A dict to keep the running totals in
+                force (bool): True to update all podcasts, due or not
+
+            Returns:
+                dict: The added, downloaded, removed and skipped totals, along
+                    with the feeds polled, those not yet due, the downloads
+                    reused from other episodes, the failures, the
+                    utilisation of the download and tag stages and the
+                    HTTP connections opened and reused
+        """
+        if totals is None:
+            totals = {}
+        for key in ('polled', 'not_due', 'added', 'downloaded', 'reused', 'removed', 'skipped', 'failed'):
+            totals.setdefault(key, 0)
+        if podcasts is None:
+            now = utc_now()
+            subscribed = list(Podcast.select())
+            podcasts = [x for x in subscribed if force or x.is_due(now)]
+            totals['not_due'] += len(subscribed) - len(podcasts)
+        artwork = ArtworkCache.from_settings(self.settings)
+        dedupe = DedupeIndex.load() if self.dedupe else None
+        connections = http_client.counts.snapshot()
+        busy = {'download': 0.0, 'tag': 0.0}
+        running = {'download': 0, 'tag': 0}
+        waiting = deque()
+        downloaded = deque()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as feeds, \
+             ThreadPoolExecutor(max_workers=self.download_workers) as downloads, \
+             tag_pool(self.tag_workers) as tags:
+            pending = {}
+            for podcast in self.interleave(podcasts):
+                known_ids = podcast.recent_episode_ids() if self.streaming else None
+                pending[feeds.submit(self.fetch, podcast, known_ids)] = ('feed', podcast)
+            while pending:
+                done, _not_done = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, item = pending.pop(future)
+                    if stage == 'feed':
+                        waiting.extend(self.refresh(item, future, totals))
+                        continue
+                    running[stage] -= 1
+                    if stage == 'download':
+                        fetched = self.fetched(item, future, totals, dedupe)
+                        if fetched:
+                            busy['download'] += fetched[1]['stage_seconds']
+                            downloaded.append(fetched)
+                    else:
+                        busy['tag'] += self.complete(item, future, totals, artwork)
+                while downloaded and running['tag'] < max(self.tag_workers, 1):
+                    episode, stats, job = downloaded.popleft()
+                    pending[tags.submit(apply_tags, job)] = ('tag', (episode, stats, job))
+                    running['tag'] += 1
+                while (waiting and running['download'] < self.download_workers
+                       and running['download'] + len(downloaded) < max(self.tag_queue, 1)):
+                    episode, fname = waiting.popleft()
+                    future = downloads.submit(self.download, episode, fname, dedupe, artwork)
+                    pending[future] = ('download', (episode, fname))
+                    events.publish('download_started', episode=episode.id, podcast=episode.podcast_id,
+                                   title=episode.title)
+                    running['download'] += 1
+        seconds = time.perf_counter() - start
+        totals['utilisation'] = {
+            'download': round(busy['download'] / (seconds * self.download_workers), 3) if seconds else 0,
+            'tag': round(busy['tag'] / (seconds * max(self.tag_workers, 1)), 3) if seconds else 0}
+        self.logger.debug("Stage utilisation: Download: %.0f%%, Tag: %.0f%%"
+                          % (totals['utilisation']['download'] * 100, totals['utilisation']['tag'] * 100))
+        totals['connections'] = {key: value - connections[key]
+                                 for key, value in http_client.counts.snapshot().items()}
+        self.logger.debug("HTTP requests: %(requests)s, Connections opened: %(opened)s, reused: %(reused)s"
+                          % totals['connections'])
+        return totals
+
+    def next_due(self, podcast, now):
+        """ Decide when a podcast should next be polled
+
+            Adaptive polling waits for half the podcast's usual time between
+            episodes, at least POLL_MIN_INTERVAL, give or take POLL_JITTER so
+            feeds drift apart, and never longer than POLL_MAX_STALENESS. A
+            podcast's own refresh_interval is always respected, one that
+            can not be parsed is ignored.
+
+            Args:
+                podcast (Podcast): The podcast
+                now (datetime): The current time in UTC
+
+            Returns:
+                datetime: The next due time, None to poll on every update
+        """
+        floor = (timeparse(str(podcast.refresh_interval)) or 0) if podcast.refresh_interval else 0
+        if not self.adaptive:
+            return now + timedelta(seconds=floor) if floor else None
+        interval = podcast.publish_interval()
+        seconds = max(interval.total_seconds() * CADENCE_FACTOR if interval else 0, self.poll_min)
+        seconds *= random.uniform(1 - self.poll_jitter, 1 + self.poll_jitter)
+        seconds = max(min(seconds, self.poll_max), floor)
+        return now + timedelta(seconds=seconds)
+
+    def refresh(self, podcast, future, totals):
+        """ Ingest a fetched feed and remove expired episodes
+
+            Args:
+                podcast (Podcast): The podcast
+                future (Future): The future for the feed fetch
+                totals (dict): The running totals
+
+            Returns:
+                list: The episodes to download and their file names
+        """
+        try:
+            feed = future.result()
+            totals['polled'] += 1
+            if feed is None:
+                totals['skipped'] += 1
+            totals['added'] += podcast.ingest_feed(feed)
+            podcast.mark_refreshed(next_due=self.next_due(podcast, utc_now()))
+            totals['removed'] += podcast.remove_expired_episodes()
+            return [(episode, episode.file_path(self.settings.BASE_DIR))
+                    for episode in podcast.pending_episodes()]
+        except Exception: # pylint: disable=W0703
+            self.logger.exception("%s: Update failed" % podcast.name)
+            totals['failed'] += 1
+            return []
+
+    def download(self, episode, fname, dedupe, artwork):
+        """ Download an episode and build its tags, in a download thread
+
+            Args:
+                episode (Episode): The episode
+                fname (str): The file name
+                dedupe (DedupeIndex): The files already downloaded
+                artwork (ArtworkCache): The cache for images from a URL
+
+            Returns:
+                tuple: The download statistics, with the seconds the stage took,
+                    and the tag job, None if it could not be built
+        """
+        start = time.perf_counter()
+        stats = episode.fetch(fname, self.download_timeout, dedupe)
+        try:
+            job = episode.tag_job(fname, artwork=artwork)
+        except Exception: # pylint: disable=W0703
+            # The file is in place, it is recorded without its tags
+            self.logger.exception("%s: Building tags failed" % episode.title)
+            job = None
+        stats['stage_seconds'] = time.perf_counter() - start
+        return stats, job
+
+    def fetched(self, item, future, totals, dedupe=None):
+        """ Record a downloaded episode and collect it for the tag stage
+
+            The download is recorded before the file is tagged, a file that
+            fails to tag is not downloaded again.
+
+            Args:
+                item (tuple): The episode and its file name
+                future (Future): The future for the download
+                totals (dict): The running totals
+                dedupe (DedupeIndex): The index to add the episode to
+
+            Returns:
+                tuple: The episode, its download statistics and its tag job, None
+                    if the download failed or there is nothing to tag
+        """
+        episode, fname = item
+        try:
+            stats, job = future.result()
+        except Exception: # pylint: disable=W0703
+            self.logger.exception("%s: Download failed" % episode.title)
+            totals['failed'] += 1
+            events.publish('download_failed', episode=episode.id, podcast=episode.podcast_id)
+            return None
+        episode.finish_download(fname, stats=stats)
+        totals['downloaded'] += 1
+        if stats.get('reused'):
+            totals['reused'] += 1
+        if dedupe is not None:
+            dedupe.add(episode.dedupe_source())
+        if job is None:
+            totals['failed'] += 1
+            events.publish('tag_failed', episode=episode.id, podcast=episode.podcast_id)
+            return None
+        return episode, stats, job
+
+    def complete(self, item, future, totals, artwork=None):
+        """ Record a tagged episode
+
+            Args:
+                item (tuple): The episode, its download statistics and its tag job
+                future (Future): The future for the tag job
+                totals (dict): The running totals
+                artwork (ArtworkCache): The cache to store artwork resized by the job in
+
+            Returns:
+                float: The seconds the tag stage took
+        """
+        episode, stats, job = item
+        try:
+            result = future.result()
+            episode.tagged(job, result)
+            if artwork is not None and result['image'] is not None:
+                artwork.store(episode.podcast.image or episode.image, result['image'])
+            events.publish('episode_tagged', episode=episode.id, podcast=episode.podcast_id,
+                           file_name=episode.file_name, reused=stats.get('reused'))
+            return result['image_seconds'] + result['tag_seconds']
+        except Exception: # pylint: disable=W0703
+            self.logger.exception("%s: Tagging failed" % episode.title)
+            totals['failed'] += 1
+            events.publish('tag_failed', episode=episode.id, podcast=episode.podcast_id)
+            return 0.0
@@ -1,11 +1,16 @@
 """ Shared utilities
 """
+import html
 import re
 from datetime import datetime
+from email.utils import parsedate_to_datetime
 import json
-import requests
+import pytz
+from dateutil import parser
 from unidecode import unidecode
 
+from . import http_client
+
 def get_valid_filename(string):
     """ Return a filename given a string
 
@@ -21,15 +26,61 @@ def get_valid_filename(string):
     string = re.sub(r'[-]{2,}', '', string)
     return unidecode(string)
 
-def slack(added, removed, downloaded, webhook_url):
+def plain_text(string):
+    """ Reduce show notes, which are often HTML, to plain text
+
+        Args:
+            string (str): The text or HTML, may be None
+
+        Returns:
+            str: The text, None if there is none
+    """
+    if not string:
+        return None
+    string = html.unescape(re.sub(r'<[^>]+>', ' ', string))
+    return re.sub(r'\s+', ' ', string).strip() or None
+
+def to_utc(value):
+    """ Normalize a timestamp to a naive datetime in UTC
+
+        Timestamps without a timezone are taken to be UTC already.
+
+        Args:
+            value (str|datetime): A timestamp
+
+        Returns:
+            datetime: The timestamp in UTC, without tzinfo
+    """
+    if isinstance(value, str):
+        try:
+            value = parsedate_to_datetime(value)
+        except (TypeError, ValueError, IndexError):
+            value = parser.parse(value)
+    if value.tzinfo is None or value.tzinfo.utcoffset(value) is None:
+        return value
+    return value.astimezone(pytz.utc).replace(tzinfo=None)
+
+def utc_now():
+    """ Return the current time as a naive datetime in UTC
+
+        Returns:
+            datetime: The current time
+    """
+    return datetime.now(pytz.utc).replace(tzinfo=None)
+
+def slack(added, removed, downloaded, webhook_url, skipped=0, polled=None, not_due=0):
     """ docstring
     """
     title = "Update complete"
     attachments = []
     fields = []
+    if polled is not None:
+        fields.append({'value': 'Feeds polled: %s' % polled})
+        fields.append({'value': 'Feeds not due: %s' % not_due})
     fields.append({'value': 'Episodes added: %s' % added})
     fields.append({'value': 'Episodes downloaded: %s' % downloaded})
     fields.append({'value': 'Episodes removed: %s' % removed})
+    fields.append({'value': 'Feeds unchanged: %s' % skipped})
     color = 'good'
     attachments.append({
         'title': title,
@@ -41,7 +92,7 @@ def slack(added, removed, downloaded, webhook_url):
         'parse': 'none',
         'attachments': attachments
     }
-    requests.post(webhook_url, json=payload)
+    http_client.post(webhook_url, json=payload)
 
 class DateTimeEncoder(json.JSONEncoder):
     def default(self, o):